@@ -0,0 +1,89 @@
+import os
+import json
+import unittest
+from unittest.mock import patch
+
+from truffleHog.store import FindingsStore
+from truffleHog.whitelist import ScanResults, Remediation
+from tests.test_whitelist import whitelist_object
+from tests.test_utils import temporary_directory
+
+
+class TestFindingsStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = temporary_directory()
+        self.store = FindingsStore(os.path.join(self.directory, "findings.db"))
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_upsert_replaces_entries_with_the_same_guid(self):
+        entries = whitelist_object()
+        self.store.upsert(entries)
+        assert len(self.store) == 2
+
+        entries[0].classification = "FALSE_POSITIVE"
+        self.store.upsert(entries[:1])
+        assert len(self.store) == 2
+        assert self.store.get(entries[0].secretGuid).classification == "FALSE_POSITIVE"
+        assert self.store.read(acknowledged_only=True) == {entries[0]}
+        assert self.store.find(classification="UNCLASSIFIED") == {entries[2]}
+        assert len(self.store.find(path="truffleHog.py")) == 2
+        assert self.store.find(path="truffleHog.py", commitHash=entries[2].commitHash) == {entries[2]}
+        assert self.store.get("missing") is None
+
+    def test_write_drops_entries_no_longer_reported(self):
+        entries = whitelist_object()
+        self.store.write(entries)
+        self.store.write(entries[:1])
+        assert self.store.read() == {entries[0]}
+
+    def test_write_only_touches_changed_rows(self):
+        entries = whitelist_object()
+        self.store.write(entries)
+        written = self.store.connection.total_changes
+        self.store.write(entries)
+        assert self.store.connection.total_changes == written
+
+        entries[2].classification = "FALSE_POSITIVE"
+        self.store.write(entries)
+        assert self.store.connection.total_changes == written + 1
+
+    def test_json_round_trip(self):
+        whitelist_path = os.path.join(self.directory, "whitelist.json")
+        exported_path = os.path.join(self.directory, "exported.json")
+        ScanResults.write_whitelist_to_disk(whitelist_object(), whitelist_path)
+
+        self.store.import_json(whitelist_path)
+        self.store.export_json(exported_path)
+        with open(whitelist_path) as original, open(exported_path) as exported:
+            original = sorted(map(json.dumps, json.load(original)))
+            exported = sorted(map(json.dumps, json.load(exported)))
+        # Two of the three entries share a secretGuid and are stored once.
+        assert len(original) == 3 and len(exported) == 2
+        assert set(exported) <= set(original)
+
+    def test_scan_results_read_acknowledged_secrets_from_the_store(self):
+        entries = whitelist_object()
+        entries[2].classification = "REMEDIATED"
+        self.store.write(entries)
+
+        scan = ScanResults(store=self.store)
+        assert scan.known_secrets == {entries[2]}
+        scan.possible_secrets = set(whitelist_object())
+        scan.reconcile_secrets()
+        scan.write_whitelist(scan.reconciled_results)
+        assert self.store.get(entries[2].secretGuid).classification == "REMEDIATED"
+
+    def test_remediation_updates_the_store(self):
+        self.store.write(whitelist_object())
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            with patch("builtins.input", side_effect=["", "r", "s"]):
+                Remediation.remediate_secrets(self.store)
+        finally:
+            os.chdir(cwd)
+        # Both stored entries carry the string classified first.
+        assert {entry.classification for entry in self.store.read()} == {"REMEDIATED"}
+        assert not os.path.exists(os.path.join(self.directory, "whitelist.json"))
@@ -1,4 +1,6 @@
 import os
+import json
+import jsons
 
 import unittest
 import pytest
@@ -10,7 +12,9 @@ from truffleHog.whitelistExamples import (
     MockedWhitelistAcknowledged,
 )
 
-from truffleHog.whitelist import WhitelistEntry, WhitelistStatistics, ScanResults
+from git import Repo
+from truffleHog.whitelist import WhitelistEntry, WhitelistStatistics, WhitelistIndex, ScanResults, Remediation, MetricCalculation, Finding, StreamingStatistics
+from tests.test_utils import make_repo, temporary_directory
 
 def whitelist_object():
     # Remember some of these whitelist entries are duplicates by virtue of the fact that their secretGuids are equivalent
@@ -128,3 +132,130 @@ class TestStringMethods(unittest.TestCase):
         assert type(wls.to_dict()) == dict
         assert wls.to_dict()["Total Strings"] == 2
         assert wls.to_dict()["Unique Strings"] == 1
+
+    def test_refs_are_not_written_to_whitelist(self):
+        entries = whitelist_object()
+        entries[0].refs = ["main"]
+        cwd = os.getcwd()
+        os.chdir(temporary_directory())
+        try:
+            ScanResults.write_whitelist_to_disk(entries[:1])
+            with open("whitelist.json", "r") as whitelist:
+                assert "refs" not in whitelist.read()
+        finally:
+            os.chdir(cwd)
+        wls = WhitelistStatistics(entries[:1], pipeline_mode=False)
+        assert "main" in wls.top_refs()
+
+    def test_Finding_is_compact_and_matches_its_WhitelistEntry(self):
+        finding = Finding("7147cc7525c27d459154438e3284e03a73688907", "truffleHog.py", "High Entropy", "+1234567890abcdefABCDEF")
+        duplicate = Finding("7147cc7525c27d459154438e3284e03a73688907", "truffleHog.py", "AWS API Key", "+1234567890abcdefABCDEF")
+        assert not hasattr(finding, "__dict__")
+        assert finding == duplicate and len({finding, duplicate}) == 1
+
+        entry = finding.to_whitelist_entry("a commit", "flower@flowers-MacBook-Pro.local", "2016-12-31 23:15:08")
+        assert entry == WhitelistEntry(
+            commit="a commit",
+            commitAuthor="flower@flowers-MacBook-Pro.local",
+            commitHash="7147cc7525c27d459154438e3284e03a73688907",
+            date="2016-12-31 23:15:08",
+            path="truffleHog.py",
+            reason="High Entropy",
+            stringDetected="+1234567890abcdefABCDEF",
+        )
+        assert entry.stringDetected == "1234567890abcdefABCDEF"
+
+    def test_WhitelistIndex_lookups(self):
+        entries = whitelist_object()
+        index = WhitelistIndex(entries)
+        assert len(index) == 2
+        assert entries[1] in index
+        assert index.get("5beef298005122c34d8bab7abd1ef842") is entries[0]
+        assert len(index.with_string("1234567890abcdefABCDEF")) == 2
+        assert index.with_string("not whitelisted") == []
+
+        Remediation.update_secret("1234567890abcdefABCDEF", "FALSE_POSITIVE", index)
+        assert all(entry.is_acknowledged() for entry in index)
+
+    def test_streaming_statistics_count_without_keeping_commits(self):
+        stats = StreamingStatistics()
+        for entry in whitelist_object():
+            stats.add(entry)
+        assert (stats.total, len(stats.strings), stats.commits) == (3, 1, 2)
+
+    def test_read_acknowledged_entries_only(self):
+        entries = whitelist_object()
+        entries[0].classification = "REMEDIATED"
+        cwd = os.getcwd()
+        os.chdir(temporary_directory())
+        try:
+            ScanResults.write_whitelist_to_disk(entries)
+            assert len(ScanResults.read_whitelist_from_disk()) == 2
+            known = ScanResults.read_whitelist_from_disk(acknowledged_only=True)
+        finally:
+            os.chdir(cwd)
+        assert [entry.secretGuid for entry in known] == ["5beef298005122c34d8bab7abd1ef842"]
+
+    def test_acknowledgements_from_whitelist_revisions(self):
+        entries = whitelist_object()
+        revisions = []
+        for classification, kept in (("UNCLASSIFIED", 3), ("FALSE_POSITIVE", 3), ("FALSE_POSITIVE", 1), ("REMEDIATED", 3)):
+            entries[0].classification = classification
+            revisions.append({"whitelist.json": json.dumps(jsons.dump(entries[0:kept:2]))})
+        revisions.insert(2, {"other.txt": "unrelated\n"})
+        repo = Repo(make_repo(revisions))
+        commits = [c.hexsha for c in repo.iter_commits(reverse=True)]
+
+        assert MetricCalculation.find_divergent_results(commits[1], repo) == {entries[0]}
+        assert MetricCalculation.find_divergent_results(commits[2], repo) == set()
+        acknowledgements = list(MetricCalculation.find_acknowledgements("HEAD", repo))
+        assert [(commit, [e.classification for e in results]) for commit, results in acknowledgements] == [
+            (commits[1], ["FALSE_POSITIVE"]),
+            (commits[4], ["REMEDIATED"]),
+        ]
+        assert list(MetricCalculation.find_acknowledgements(f"{commits[1]}..HEAD", repo))[0][0] == commits[4]
+
+        cwd = os.getcwd()
+        os.chdir(temporary_directory())
+        try:
+            MetricCalculation.dump_json_range("HEAD", repo)
+            records = {}
+            for name in os.listdir("."):
+                with open(name) as record:
+                    records[name] = json.load(record)
+        finally:
+            os.chdir(cwd)
+        guid = entries[0].secretGuid
+        assert sorted(records) == [f"{commit}-{guid}.json" for commit in sorted((commits[1], commits[4]))]
+        record = records[f"{commits[4]}-{guid}.json"]
+        assert (record["ackCommit"], record["classification"]) == (commits[4], "REMEDIATED")
+        assert record["ackAuthor"] == repo.commit(commits[4]).committer.email
+
+    def test_whitelist_is_only_rewritten_when_an_entry_changes(self):
+        entries = whitelist_object()[1:]
+        cwd = os.getcwd()
+        os.chdir(temporary_directory())
+        try:
+            ScanResults.write_whitelist_to_disk(entries)
+            written = os.stat("whitelist.json").st_ino
+            ScanResults.write_whitelist_to_disk(list(reversed(entries)))
+            assert os.stat("whitelist.json").st_ino == written
+
+            entries[1].classification = "FALSE_POSITIVE"
+            ScanResults.write_whitelist_to_disk(entries)
+            assert os.stat("whitelist.json").st_ino != written
+            assert os.listdir(".") == ["whitelist.json"]
+            with open("whitelist.json") as whitelist:
+                assert [entry["classification"] for entry in json.load(whitelist)] == ["UNCLASSIFIED", "FALSE_POSITIVE"]
+        finally:
+            os.chdir(cwd)
+
+    def test_whitelist_changes(self):
+        previous = jsons.dump(whitelist_object())
+        current = jsons.dump(whitelist_object())
+        assert ScanResults.whitelist_changes(previous, current) == set()
+        current[2]["classification"] = "REMEDIATED"
+        assert ScanResults.whitelist_changes(previous, current[1:]) == {"5beef298005122c5beef29800abd1ef842"}
+        assert ScanResults.whitelist_changes(previous, current[2:]) == {
+            "5beef298005122c5beef29800abd1ef842", "5beef298005122c34d8bab7abd1ef842"
+        }
@@ -0,0 +1,76 @@
+import os
+import multiprocessing
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+from truffleHog.paths import read_patterns
+
+# How many repositories may wait, opened, for a scan worker, per worker.
+QUEUED_PER_WORKER = 2
+
+
+def read_manifest(path):
+    """
+    The repository paths and URLs of a --batch manifest, one per line. Blank
+    lines and lines starting with "#" are ignored.
+    """
+    return read_patterns(path)
+
+
+def schedule(sources, resolve, scan, fetchers=4, jobs=None):
+    """
+    Yields (source, result, error) for every source, in the order the scans
+    finish. `resolve` opens a source, cloning or fetching it, on one of
+    `fetchers` threads, since that is git I/O. `scan` is then called with the
+    source and the path of its handle in one of `jobs` worker processes, so
+    some repositories are fetched while others are scanned.
+
+    Opening stops while QUEUED_PER_WORKER repositories per worker wait for a
+    scan, which bounds the clones on disk. A handle is released once its scan
+    is done, which removes a temporary clone.
+
+    The workers are forked, whatever the platform's default start method, so
+    they inherit the rules compiled by the parent; this needs a POSIX system.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    sources = iter(sources)
+    resolving = {}
+    scanning = {}
+    queued = []
+
+    with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork")) as scan_pool:
+        # Forked workers start on the first task. Starting them before any
+        # fetcher thread exists keeps them from inheriting a lock one holds.
+        scan_pool.submit(int).result()
+        with ThreadPoolExecutor(fetchers) as io_pool:
+
+            def refill():
+                while queued and len(scanning) < jobs:
+                    source, repo = queued.pop(0)
+                    scanning[scan_pool.submit(scan, source, repo.git_dir)] = (source, repo)
+                while len(resolving) < fetchers and len(queued) < jobs * QUEUED_PER_WORKER:
+                    source = next(sources, None)
+                    if source is None:
+                        return
+                    resolving[io_pool.submit(resolve, source)] = source
+
+            refill()
+            while resolving or scanning:
+                done, _ = wait([*resolving, *scanning], return_when=FIRST_COMPLETED)
+                for future in done:
+                    opened = future in resolving
+                    source = resolving.pop(future) if opened else scanning.pop(future)[0]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        yield source, None, e
+                        continue
+                    if opened:
+                        queued.append((source, result))
+                    else:
+                        yield source, result, None
+                refill()
@@ -0,0 +1,47 @@
+from collections import OrderedDict
+
+NULL_HEX_SHA = "0" * 40
+
+
+def blob_pair(blob):
+    """
+    The (old blob, new blob) SHAs of a diff entry, or None when the new side has
+    no blob in the object database yet (e.g. a working tree file).
+    """
+    a_blob = getattr(blob.a_blob, "hexsha", blob.a_blob)
+    b_blob = getattr(blob.b_blob, "hexsha", blob.b_blob)
+    if not b_blob or b_blob == NULL_HEX_SHA:
+        return None
+    return a_blob, b_blob
+
+
+class MatchCache:
+    """
+    Raw detector matches keyed by the blob pair of a diff entry. Cherry-picks,
+    reverts, rebases and merges produce the same patch in many commits, so a hit
+    only has to attach the new commit's metadata. The least recently used pairs
+    are evicted once `maxsize` pairs are held.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, matches):
+        self.entries[key] = matches
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,68 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+from git import Repo
+
+
+def clone_options(depth=None, blob_filter=None):
+    """
+    The Repo.clone_from options of a depth-limited or blob-filtered clone.
+    """
+    options = {}
+    if depth:
+        options["depth"] = depth
+    if blob_filter:
+        options["filter"] = blob_filter
+    return options
+
+
+def source_name(url):
+    """
+    A file name for `url`: a digest of the whole URL, so no two URLs share a
+    name, followed by the repository name.
+    """
+    name = re.sub(r"[^\w.-]", "_", url.rstrip("/").rsplit("/", 1)[-1])
+    if name.endswith(".git"):
+        name = name[: -len(".git")]
+    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    return f"{digest}-{name}"
+
+
+def mirror_path(cache_dir, url):
+    """
+    Where the mirror of `url` lives in the cache.
+    """
+    return os.path.join(cache_dir, f"{source_name(url)}.git")
+
+
+def mirror(url, cache_dir, depth=None, blob_filter=None):
+    """
+    A handle on the bare mirror of `url` in `cache_dir`. The first run clones
+    the mirror and later runs fetch only what changed since, pruning deleted
+    refs. A mirror cloned with a blob filter keeps fetching with it, and
+    fetches blobs it lacks when a diff reads them.
+    """
+    path = mirror_path(cache_dir, url)
+    if os.path.isdir(path):
+        repo = Repo(path)
+        depth = [f"--depth={depth}"] if depth else []
+        repo.git.fetch("--prune", *depth, "origin")
+        return repo
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Cloned aside and renamed into place, so an interrupted clone never
+    # leaves a broken mirror behind.
+    staging = tempfile.mkdtemp(prefix=".clone-", dir=cache_dir)
+    try:
+        Repo.clone_from(url, staging, mirror=True, **clone_options(depth, blob_filter))
+        try:
+            os.rename(staging, path)
+        except OSError:
+            # Another run cloned the same URL first.
+            if not os.path.isdir(path):
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return Repo(path)
@@ -0,0 +1,130 @@
+import os
+import hmac
+import json
+import stat
+import socket
+import socketserver
+
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+DEFAULT_HOST = "127.0.0.1"
+# Read from the environment rather than the command line, which every local
+# user can see.
+TOKEN_ENV = "TRUFFLEHOG_DAEMON_TOKEN"
+
+
+def parse_address(address):
+    """
+    A --daemon address: a Unix socket path (anything with a "/", or a
+    "unix:" prefix), else a port or host:port on a loopback interface.
+    Returns (socket family, address), or raises ValueError.
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:") :]
+    if "/" in address:
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(":")
+    host = host.strip("[]") or DEFAULT_HOST
+    if host not in LOOPBACK_HOSTS:
+        raise ValueError(f"{host} is not a loopback address")
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return family, (host, int(port))
+
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # One JSON request per line, each answered by one JSON line.
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                payload = json.loads(line)
+                if not self.server.authorized(payload):
+                    raise PermissionError("Missing or invalid token")
+                response = self.server.handler(payload)
+            except (Exception, SystemExit) as e:
+                response = {"ok": False, "error": str(e) or type(e).__name__}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _TCP6Server(_TCPServer):
+    address_family = socket.AF_INET6
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Only the user running the daemon may connect.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        if _is_socket(self.server_address):
+            os.remove(self.server_address)
+
+
+def make_server(address, handle_request, token=None):
+    """
+    A threaded server answering, at `address`, each JSON request line with
+    the JSON line handle_request returns for it. An exception becomes an
+    {"ok": false, "error": ...} response. A stale Unix socket left by a
+    previous daemon is replaced, but any other file at `address` is left
+    alone and the server refused.
+
+    With a `token`, a request without the same "token" is refused. Any local
+    user can connect to a loopback port, so a TCP server needs one; a Unix
+    socket is already reserved to the user running the daemon.
+    """
+    family, address = parse_address(address)
+    if family != socket.AF_UNIX and not token:
+        raise ValueError(f"A TCP daemon needs a token: set {TOKEN_ENV}")
+    if family == socket.AF_UNIX:
+        if _is_socket(address):
+            os.remove(address)
+        elif os.path.lexists(address):
+            raise ValueError(f"{address} exists and is not a socket")
+        server = _UnixServer(address, _RequestHandler)
+    elif family == socket.AF_INET6:
+        server = _TCP6Server(address, _RequestHandler)
+    else:
+        server = _TCPServer(address, _RequestHandler)
+    server.handler = handle_request
+    server.authorized = lambda payload: not token or hmac.compare_digest(
+        str(payload.get("token", "")).encode("utf-8"), token.encode("utf-8")
+    )
+    return server
+
+
+def request(address, payload, timeout=None, token=None):
+    """
+    Sends one request to the daemon at `address` and returns its response,
+    for git hooks and editor integrations. The token defaults to the one in
+    the environment.
+    """
+    token = token or os.environ.get(TOKEN_ENV)
+    if token:
+        payload = {**payload, "token": token}
+    family, address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(address)
+        connection.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+        with connection.makefile("rb") as response:
+            return json.loads(response.readline())
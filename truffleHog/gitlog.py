@@ -0,0 +1,347 @@
+import os
+import subprocess
+from collections import namedtuple
+from git.diff import Diff
+
+LOG_FORMAT = "%x00commit %H%x00%P%x00%ae%x00%ct%x00%B%x00"
+RECORD_MARKER = b"\n\x00commit "
+ALL_REFS = ("HEAD", "--branches", "--tags", "--remotes")
+NULL_HEX_SHA = "0" * 40
+CHUNK_SIZE = 1 << 16
+
+Author = namedtuple("Author", ["email"])
+LoggedCommit = namedtuple(
+    "LoggedCommit", ["hexsha", "parents", "author", "committed_date", "message"]
+)
+LoggedDiff = namedtuple(
+    "LoggedDiff", ["a_path", "b_path", "a_blob", "b_blob", "new_file", "diff"]
+)
+Change = namedtuple("Change", ["path", "a_blob", "b_blob", "status"])
+
+
+def _decode(value):
+    return value.decode("utf-8", errors="replace") if value else None
+
+
+def _blob(blob_id):
+    blob_id = _decode(blob_id)
+    if blob_id is None or blob_id == NULL_HEX_SHA:
+        return None
+    return blob_id
+
+
+def parse_patch(patch):
+    """
+    Splits the patch of one commit into LoggedDiffs, using GitPython's own
+    header pattern so paths and diff text match what Commit.diff() returns.
+    """
+    headers = list(Diff.re_header.finditer(patch))
+    entries = []
+    for index, header in enumerate(headers):
+        end = headers[index + 1].start() if index + 1 < len(headers) else len(patch)
+        groups = header.groupdict()
+        a_path = Diff._pick_best_path(
+            groups["a_path"], groups["rename_from"], groups["a_path_fallback"]
+        )
+        b_path = Diff._pick_best_path(
+            groups["b_path"], groups["rename_to"], groups["b_path_fallback"]
+        )
+        entries.append(
+            LoggedDiff(
+                a_path=_decode(a_path),
+                b_path=_decode(b_path),
+                a_blob=_blob(groups["a_blob_id"]),
+                b_blob=_blob(groups["b_blob_id"]),
+                new_file=bool(groups["new_file_mode"]),
+                diff=patch[header.end() : end],
+            )
+        )
+    return entries
+
+
+def changed_entries(entries):
+    """
+    The modified entries followed by the added ones, as scan_commit selects them
+    with DiffIndex.iter_change_type("M") and ("A").
+    """
+    modified = [e for e in entries if e.a_blob and e.b_blob and e.a_blob != e.b_blob]
+    added = [e for e in entries if e.new_file]
+    return modified + added
+
+
+def _parse_record(record):
+    hexsha, parents, email, committed_date, message, patch = record.split(b"\x00", 5)
+    commit = LoggedCommit(
+        hexsha=_decode(hexsha),
+        parents=_decode(parents).split() if parents else [],
+        author=Author(_decode(email) or ""),
+        committed_date=int(committed_date),
+        message=_decode(message) or "",
+    )
+    return commit, patch
+
+
+def _iter_records(stream):
+    pending = bytearray(b"\n")
+    searched = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+        while True:
+            found = pending.find(RECORD_MARKER, searched)
+            if found == -1:
+                searched = max(0, len(pending) - len(RECORD_MARKER) + 1)
+                break
+            record = bytes(pending[:found])
+            del pending[: found + len(RECORD_MARKER)]
+            searched = 0
+            if record:
+                # The marker swallows the newline ending the previous patch.
+                yield record + b"\n"
+    if pending.strip():
+        yield bytes(pending)
+
+
+def _committed_dates(repo, revisions):
+    dates = {}
+    for line in repo.git.log("--format=%H %ct", *revisions).splitlines():
+        hexsha, committed_date = line.split()
+        dates[hexsha] = int(committed_date)
+    return dates
+
+
+def iter_log(repo, *revisions, max_count=None, commits=None, paths=()):
+    """
+    Streams the history from a single long-lived `git log -p` process, yielding
+    (commit, parent, diff entries) for every commit as soon as its patch has been
+    read. Merges are diffed against their first parent, and a root commit is
+    diffed against itself, as scan_commit does.
+
+    When `commits` is given, only those commits are logged, in that order.
+    Pathspecs in `paths` limit the patches, not the commits that are logged.
+    """
+    if commits is not None and not commits:
+        return
+    args = [
+        f"--format={LOG_FORMAT}",
+        "-p",
+        "--diff-merges=first-parent",
+        "-M",
+        "--full-index",
+        "--abbrev=40",
+        "--no-textconv",
+        "--no-ext-diff",
+        "--no-color",
+        "--no-show-signature",
+    ]
+    if max_count is not None:
+        args.append(f"--max-count={max_count}")
+    args.extend(revisions)
+    if commits is not None:
+        args.extend(["--no-walk=unsorted", "--stdin"])
+    if paths:
+        # Every commit is still listed, even one that touches none of the paths.
+        args.extend(["--full-history", "--sparse", "--", *paths])
+
+    # Loading every date up front pays off only for a walk of the whole
+    # history; the parents of a few listed commits are looked up one by one.
+    dates = _committed_dates(repo, revisions) if commits is None and max_count is None else {}
+    git = repo.git(c=["diff.noprefix=false", "diff.mnemonicPrefix=false"])
+    if commits is None:
+        proc = git.log(*args, as_process=True)
+    else:
+        proc = git.log(*args, as_process=True, istream=subprocess.PIPE)
+        # git reads every revision from stdin before it starts writing the log.
+        proc.stdin.write("\n".join(commits).encode("ascii") + b"\n")
+        proc.stdin.close()
+    completed = False
+    try:
+        for record in _iter_records(proc.stdout):
+            commit, patch = _parse_record(record)
+            if not commit.parents:
+                yield commit, commit, []
+                continue
+            parent_sha = commit.parents[0]
+            if parent_sha not in dates:
+                dates[parent_sha] = repo.commit(parent_sha).committed_date
+            parent = LoggedCommit(parent_sha, None, None, dates[parent_sha], None)
+            yield commit, parent, parse_patch(patch)
+        completed = True
+    finally:
+        if completed:
+            proc.wait()
+        else:
+            proc.proc.kill()
+            proc.proc.wait()
+
+
+def _ref_tips(repo):
+    tips = {}
+    refs = repo.git.for_each_ref(
+        "--format=%(refname:short)%00%(symref)%00%(objecttype)%00%(objectname)%00%(*objecttype)%00%(*objectname)",
+        "refs/heads",
+        "refs/tags",
+        "refs/remotes",
+    )
+    for line in refs.splitlines():
+        name, symref, object_type, sha, peeled_type, peeled_sha = line.split("\x00")
+        if symref:
+            continue
+        if object_type == "commit":
+            tips[name] = sha
+        elif peeled_type == "commit":
+            tips[name] = peeled_sha
+    return tips
+
+
+class RevisionWalk(
+    namedtuple("RevisionWalk", ["revisions", "max_count", "since"], defaults=[None, None])
+):
+    """
+    The commits of one `git rev-list`, newest first: those reachable from
+    `revisions`, in rev-list syntax so base..head and ^base leave out the
+    history of base, at most `max_count` of them and none committed before
+    `since`.
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def from_options(commit=None, since_commit=None, max_depth=None, since_date=None, all_refs=False):
+        """
+        The walk the range options select, or None when they select the whole
+        history or a single commit. A single commit given with other range
+        options is the head of the walk.
+        """
+        is_range = bool(commit) and ".." in commit
+        if not (is_range or since_commit or max_depth or since_date):
+            return None
+        if commit:
+            revisions = [commit]
+        else:
+            revisions = list(ALL_REFS if all_refs else ("HEAD",))
+        if since_commit:
+            revisions.append(f"^{since_commit}")
+        return RevisionWalk(tuple(revisions), max_depth, since_date)
+
+    def args(self):
+        args = []
+        if self.max_count is not None:
+            args.append(f"--max-count={self.max_count}")
+        if self.since:
+            args.append(f"--since={self.since}")
+        return args + list(self.revisions)
+
+    def resolve(self, repo):
+        return repo.git.rev_list(*self.args()).split()
+
+    def __str__(self):
+        return " ".join(self.args())
+
+
+class RefMap:
+    """
+    The branches and tags whose history holds each commit. Every ref is a bit;
+    one topological walk of the graph, children before parents, ORs each
+    commit's bits into its parents.
+    """
+
+    def __init__(self, repo):
+        tips = sorted(_ref_tips(repo).items())
+        self.names = [name for name, _ in tips]
+        self.masks = {}
+        for bit, (_, sha) in enumerate(tips):
+            self.masks[sha] = self.masks.get(sha, 0) | (1 << bit)
+
+        walk = repo.git.rev_list("--topo-order", "--parents", *ALL_REFS)
+        for line in walk.splitlines():
+            sha, *parents = line.split()
+            mask = self.masks.get(sha, 0)
+            for parent in parents:
+                self.masks[parent] = self.masks.get(parent, 0) | mask
+
+    def __getitem__(self, commit):
+        mask = self.masks.get(commit, 0)
+        return [name for bit, name in enumerate(self.names) if mask >> bit & 1]
+
+
+def is_shallow(repo):
+    """
+    Whether the repository is a shallow clone, whose oldest commits list
+    parents it does not have.
+    """
+    return os.path.exists(os.path.join(repo.git_dir, "shallow"))
+
+
+def iter_changes(repo, *revisions, commits=None, paths=()):
+    """
+    Yields (commit, parents, changes) for every commit from a single
+    `git log --raw`, which compares trees without reading any blob, so no diff
+    text is produced. Merges are compared with their first parent, as in
+    iter_log, and renames are listed as a deletion and an addition.
+    """
+    if commits is not None and not commits:
+        return
+    args = [
+        "--format=%H %P",
+        "--raw",
+        "--no-renames",
+        "--abbrev=40",
+        "--diff-merges=first-parent",
+        "-z",
+        *revisions,
+    ]
+    if commits is not None:
+        args.extend(["--no-walk=unsorted", "--stdin"])
+    if paths:
+        args.extend(["--full-history", "--sparse", "--", *paths])
+
+    if commits is None:
+        log = repo.git.log(*args)
+    else:
+        log = repo.git.log(*args, istream=subprocess.PIPE, as_process=True)
+        log = log.proc.communicate("\n".join(commits).encode("ascii") + b"\n")[0]
+        log = log.decode("utf-8", errors="surrogateescape")
+
+    commit = None
+    header = None
+    for token in log.split("\x00"):
+        token = token.lstrip("\n")
+        if header is not None:
+            _, _, a_blob, b_blob, status = header.split()
+            changes.append(
+                Change(token, _blob(a_blob.encode("ascii")), _blob(b_blob.encode("ascii")), status)
+            )
+            header = None
+        elif token.startswith(":"):
+            header = token
+        elif token:
+            if commit is not None:
+                yield commit, parents, changes
+            commit, *parents = token.split()
+            changes = []
+    if commit is not None:
+        yield commit, parents, changes
+
+
+def blob_sizes(repo, blobs):
+    """
+    The size of every blob, read from the object headers by a single
+    `git cat-file --batch-check`.
+    """
+    if not blobs:
+        return {}
+    proc = repo.git.cat_file(
+        "--batch-check=%(objectname) %(objectsize)",
+        istream=subprocess.PIPE,
+        as_process=True,
+    )
+    out = proc.proc.communicate("\n".join(blobs).encode("ascii") + b"\n")[0]
+    sizes = {}
+    for line in out.decode("ascii").splitlines():
+        blob, size = line.split()
+        if size != "missing":
+            sizes[blob] = int(size)
+    return sizes
@@ -0,0 +1,132 @@
+import re
+from collections import namedtuple
+
+CHUNK_SIZE = 1 << 20
+OVERLAP = 4096
+SAMPLE_SIZE = 1 << 16
+MINIFIED_LINE_LENGTH = 500
+# Credentials such as service account keys, JWTs or PEM blocks are often a
+# single long line, so only scripts and stylesheets at least this large are
+# taken for minified by their line length.
+MINIFIED_MIN_SIZE = 1 << 14
+
+# Bytes that never occur inside a base64 or hex run, nor inside most tokens the
+# regex rules look for, so a window cut just after one rarely splits a secret.
+SEPARATORS = tuple(bytes([c]) for c in b" \t;,'\"<>(){}[]")
+GENERATED_PATH = re.compile(r"(\.min\.(js|css)|\.(js|css)\.map|\.bundle\.js)$")
+# The header conventions of generated files, such as Go's "// Code generated
+# by protoc. DO NOT EDIT." or "@generated", looked for only in the first
+# HEADER_LINES lines of the file, where the conventions put them.
+GENERATED_MARKER = re.compile(rb"^[+ ][^\w\n]*(Code generated .* DO NOT EDIT\.|@generated\b)", re.MULTILINE)
+HEADER_LINES = 5
+FIRST_HUNK = re.compile(rb"@@ -\d+(,\d+)? \+1(,\d+)? @@")
+MINIFIABLE_PATH = re.compile(r"\.(js|mjs|cjs|css)$")
+
+
+def _boundaries(patch, start, end, separators):
+    return [p for p in (patch.find(s, start, end) for s in separators) if p != -1]
+
+
+def _file_header(patch):
+    """
+    The first lines of the new file, when the patch starts at its top: either
+    a hunk at line 1, or added lines with their hunk headers stripped.
+    """
+    lines = patch[:SAMPLE_SIZE].split(b"\n", HEADER_LINES + 1)
+    if lines[0].startswith(b"@@"):
+        if not FIRST_HUNK.match(lines[0]):
+            return b""
+        lines = lines[1:]
+    return b"\n".join(line for line in lines[:HEADER_LINES] if not line.startswith(b"-"))
+
+
+def _char_boundary(patch, position):
+    # Never cut inside a UTF-8 sequence.
+    while position < len(patch) and patch[position] & 0xC0 == 0x80:
+        position += 1
+    return position
+
+
+class BlobLimits(
+    namedtuple(
+        "BlobLimits",
+        ["max_blob_size", "skip_generated", "chunk_size", "overlap"],
+        defaults=[None, False, CHUNK_SIZE, OVERLAP],
+    )
+):
+    """
+    Bounds on the patches diff_worker scans. Patches over `max_blob_size` bytes
+    are skipped, as are minified or generated files when `skip_generated` is
+    set, and any other patch over `chunk_size` bytes is decoded and scanned one
+    window at a time instead of as a whole.
+
+    Windows bound the decoded text and the matching work, not the patch bytes,
+    which diff_worker holds whole; only `max_blob_size` bounds those.
+    """
+
+    __slots__ = ()
+
+    def skip_path(self, path):
+        """
+        Why `path` is not scanned whatever its patch, or None when it may be.
+        """
+        if self.skip_generated and GENERATED_PATH.search(path):
+            return "generated file name"
+        return None
+
+    def minifiable(self, path):
+        """
+        Whether the patch of `path` is checked for minified content, which
+        depends on the path as well as the patch.
+        """
+        return bool(self.skip_generated and MINIFIABLE_PATH.search(path))
+
+    def skip_reason(self, path, patch):
+        """
+        Why the patch of `path` is not scanned, or None when it is.
+        """
+        reason = self.skip_path(path)
+        if reason:
+            return reason
+        if self.max_blob_size is not None and len(patch) > self.max_blob_size:
+            return f"patch of {len(patch)} bytes is over the {self.max_blob_size} byte limit"
+        if not self.skip_generated:
+            return None
+        if GENERATED_MARKER.search(_file_header(patch)):
+            return "generated file marker"
+        sample = patch[:SAMPLE_SIZE]
+        if (
+            self.minifiable(path)
+            and len(patch) >= MINIFIED_MIN_SIZE
+            and len(sample) / (sample.count(b"\n") + 1) > MINIFIED_LINE_LENGTH
+        ):
+            return "minified content"
+        return None
+
+    def windows(self, patch):
+        """
+        Yields the patch in windows of about `chunk_size` bytes. Windows end
+        after a newline where the patch has one, else after a separator, and the
+        next window starts up to `overlap` bytes earlier, at a line start or just
+        after a separator. A match no longer than the overlap is thus whole in
+        some window. Only lines longer than a window can still cut a match, such
+        as the .* of a rule on a minified line.
+        """
+        overlap = min(self.overlap, self.chunk_size // 2)
+        start = cut = 0
+        while len(patch) - start > self.chunk_size:
+            end = start + self.chunk_size
+            # Each window ends past the previous one.
+            newline = patch.rfind(b"\n", cut, end)
+            if newline != -1:
+                cut = newline + 1
+            else:
+                separators = _boundaries(patch, max(cut, end - overlap), end, SEPARATORS)
+                cut = max(separators) + 1 if separators else _char_boundary(patch, end)
+            yield patch[start:cut]
+
+            back = max(start + 1, cut - overlap)
+            newlines = _boundaries(patch, back, cut - 1, (b"\n",))
+            separators = newlines or _boundaries(patch, back, cut - 1, SEPARATORS)
+            start = min(separators) + 1 if separators else cut
+        yield patch[start:]
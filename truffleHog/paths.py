@@ -0,0 +1,132 @@
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from truffleHog.scanstate import STATE_PATH
+
+EXCLUDED_SEGMENTS = ("whitelist.json", "package-lock.json", STATE_PATH)
+GLOB_SPECIALS = set("*?[\\")
+
+AT_END = (sre_parse.AT, sre_parse.AT_END)
+
+
+def read_patterns(path):
+    """
+    The regular expressions of an --include_paths/--exclude_paths file, one per
+    line. Blank lines and lines starting with "#" are ignored.
+    """
+    with open(path, "r") as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+def _literal(items):
+    text = ""
+    for op, av in items:
+        if op is not sre_parse.LITERAL:
+            return None
+        text += chr(av)
+    if not text or GLOB_SPECIALS & set(text):
+        return None
+    return text
+
+
+def _is_any_run(item):
+    # .*
+    op, av = item
+    return (
+        op is sre_parse.MAX_REPEAT
+        and av[:2] == (0, sre_parse.MAXREPEAT)
+        and list(av[2]) == [(sre_parse.ANY, None)]
+    )
+
+
+def _is_optional_directory(item):
+    # (.*/)? or (?:.*/)?
+    op, av = item
+    if op is not sre_parse.MAX_REPEAT or av[:2] != (0, 1):
+        return False
+    group = list(av[2])
+    if len(group) == 1 and group[0][0] is sre_parse.SUBPATTERN:
+        group = list(group[0][1][-1])
+    return len(group) == 2 and _is_any_run(group[0]) and group[1] == (sre_parse.LITERAL, ord("/"))
+
+
+def pathspec(pattern):
+    """
+    A git glob pathspec selecting exactly the paths the pattern matches with
+    re.match, or None when the pattern has no such translation. Three shapes
+    translate: a literal directory prefix (src/), a literal file name suffix
+    (.*\\.jmx$) and a literal file name in any directory ((.*/)?id_rsa$).
+    """
+    parsed = sre_parse.parse(pattern)
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    items = list(parsed)
+    if items and items[-1] == AT_END and len(items) > 2:
+        name = _literal(items[1:-1])
+        if name is None or "/" in name:
+            return None
+        if _is_any_run(items[0]):
+            return f"**/*{name}"
+        if _is_optional_directory(items[0]):
+            return f"**/{name}"
+        return None
+    prefix = _literal(items)
+    if prefix and prefix.endswith("/"):
+        return f"{prefix}**"
+    return None
+
+
+class PathFilter:
+    """
+    Decides which paths are scanned: at least one include pattern, if any, must
+    match, and neither an exclude pattern nor a segment of EXCLUDED_SEGMENTS
+    may. Patterns match from the start of the path, as re.match does.
+
+    The patterns that translate to git pathspecs are also handed to git, so the
+    paths they exclude are never diffed. included() is still checked on every
+    path, which covers the patterns git could not be given.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = [re.compile(pattern) for pattern in include]
+        self.exclude = [re.compile(pattern) for pattern in exclude]
+
+    @staticmethod
+    def from_files(include_path=None, exclude_path=None):
+        return PathFilter(
+            read_patterns(include_path) if include_path else (),
+            read_patterns(exclude_path) if exclude_path else (),
+        )
+
+    def included(self, path):
+        if any(segment in path for segment in EXCLUDED_SEGMENTS):
+            return False
+        if self.include and not any(pattern.match(path) for pattern in self.include):
+            return False
+        return not any(pattern.match(path) for pattern in self.exclude)
+
+    def pathspecs(self):
+        specs = []
+        include = [pathspec(pattern.pattern) for pattern in self.include]
+        # Includes are a union: git can only be given them if all translate.
+        if include and None not in include:
+            specs.extend(f":(top,glob){spec}" for spec in include)
+        for pattern in self.exclude:
+            spec = pathspec(pattern.pattern)
+            if spec is not None:
+                specs.append(f":(top,exclude,glob){spec}")
+        for segment in EXCLUDED_SEGMENTS:
+            # A path contains the segment when one of its components does.
+            specs.append(f":(top,exclude,glob)**/*{segment}*")
+            specs.append(f":(top,exclude,glob)**/*{segment}*/**")
+        return specs
+
+    def __repr__(self):
+        include = [pattern.pattern for pattern in self.include]
+        exclude = [pattern.pattern for pattern in self.exclude]
+        return f"PathFilter(include={include}, exclude={exclude})"
@@ -0,0 +1,67 @@
+from collections import namedtuple
+
+from truffleHog.gitlog import iter_changes, blob_sizes
+
+CommitPlan = namedtuple("CommitPlan", ["hexsha", "size", "entries", "dropped"])
+
+
+def plan_commits(repo, commits, path_filter, max_blob_size=None):
+    """
+    Yields a CommitPlan for every commit, in the order given, from the change
+    metadata alone: git compares trees and reads blob headers, and no patch
+    text is produced. `size` is the byte total of the new blobs the commit's
+    scan will diff and `entries` their number. `dropped` holds the (path,
+    reason) of every file over `max_blob_size`, which the scan leaves out of
+    its diff.
+
+    The changes weighed are those changed_entries selects: every one leaving a
+    new blob, so additions, modifications and type changes such as a symlink
+    replaced by a file, but not deletions or mode-only changes. Binary files
+    are weighed like any other, and left to the scan to skip, since telling
+    them apart means reading their content.
+
+    As in scan_commit, a commit is compared with its first parent and a root
+    commit with itself, so a root commit has nothing to scan.
+    """
+    changes = list(iter_changes(repo, commits=list(commits), paths=path_filter.pathspecs()))
+    sizes = blob_sizes(
+        repo, {change.b_blob for _, _, cs in changes for change in cs if change.b_blob}
+    )
+    for hexsha, parents, cs in changes:
+        size = entries = 0
+        dropped = []
+        for change in cs if parents else ():
+            if change.b_blob is None or not path_filter.included(change.path):
+                continue
+            if change.status == "M" and change.a_blob == change.b_blob:
+                continue
+            blob_size = sizes.get(change.b_blob, 0)
+            if max_blob_size is not None and blob_size > max_blob_size:
+                reason = f"file of {blob_size} bytes is over the {max_blob_size} byte limit"
+                dropped.append((change.path, reason))
+            else:
+                size += blob_size
+                entries += 1
+        yield CommitPlan(hexsha, size, entries, tuple(dropped))
+
+
+def byte_batches(plans, batches):
+    """
+    Groups the plans, in order, into about `batches` runs of similar byte
+    totals, so one commit with a large diff no longer holds a worker while
+    others sit idle on runs of small ones.
+    """
+    plans = list(plans)
+    # Every commit costs something, even one with nothing to diff.
+    target = max(1, sum(plan.size + 1 for plan in plans) // max(1, batches))
+    batch = []
+    size = 0
+    for plan in plans:
+        batch.append(plan)
+        size += plan.size + 1
+        if size >= target:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
@@ -0,0 +1,72 @@
+import sys
+import json
+import hashlib
+
+STATE_PATH = ".trufflehog_state.json"
+
+
+def whitelist_digest(entries):
+    """
+    Identifies the findings a whitelist holds, by secretGuid, so classifying
+    an entry does not change it but adding or dropping one does.
+    """
+    guids = "\n".join(sorted(entry.secretGuid for entry in entries))
+    return hashlib.sha256(guids.encode("utf-8")).hexdigest()
+
+
+class ScanState:
+    """
+    The commits whose findings are already recorded in whitelist.json, the
+    digest of the rule set they were scanned with and the digest of the
+    whitelist that recorded them. A changed rule set, or a whitelist rewritten
+    since, for instance by a --commit run, makes every commit pending again.
+    """
+
+    def __init__(self, rules_digest, commits=(), whitelist_digest=None):
+        self.rules_digest = rules_digest
+        self.commits = set(commits)
+        self.whitelist_digest = whitelist_digest
+
+    @staticmethod
+    def read(rules_digest, path=STATE_PATH, whitelist_digest=None):
+        try:
+            with open(path, "r") as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return ScanState(rules_digest)
+        except Exception as e:
+            print(f"Unable to read scan state: {e}", file=sys.stderr)
+            return ScanState(rules_digest)
+
+        if state.get("rules") != rules_digest:
+            print("Rules changed since the last scan. Rescanning all commits.", file=sys.stderr)
+            return ScanState(rules_digest)
+        if whitelist_digest is not None and state.get("whitelist") != whitelist_digest:
+            print("Whitelist changed since the last scan. Rescanning all commits.", file=sys.stderr)
+            return ScanState(rules_digest)
+        return ScanState(rules_digest, state.get("commits", []), state.get("whitelist"))
+
+    def is_scanned(self, commit):
+        return commit in self.commits
+
+    def write(self, commits, path=STATE_PATH, whitelist_digest=None):
+        """
+        Records `commits` as scanned, and the digest of the whitelist now
+        holding their findings. Commits that are no longer in the history drop
+        out of the state.
+        """
+        self.commits = set(commits)
+        self.whitelist_digest = whitelist_digest
+        try:
+            with open(path, "w+") as state_file:
+                json.dump(
+                    {
+                        "rules": self.rules_digest,
+                        "whitelist": self.whitelist_digest,
+                        "commits": sorted(self.commits),
+                    },
+                    state_file,
+                    indent=4,
+                )
+        except Exception as e:
+            print(f"Unable to write scan state: {e}", file=sys.stderr)
@@ -0,0 +1,118 @@
+import json
+import sqlite3
+
+from truffleHog.whitelist import WhitelistEntry, ScanResults, Classifications
+
+COLUMNS = (
+    "secretGuid",
+    "commit",
+    "commitAuthor",
+    "commitHash",
+    "date",
+    "path",
+    "reason",
+    "stringDetected",
+    "confidence",
+    "classification",
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS findings (
+    secretGuid TEXT PRIMARY KEY,
+    {", ".join(f'"{column}" TEXT' for column in COLUMNS[1:])}
+);
+CREATE INDEX IF NOT EXISTS findings_path ON findings (path);
+CREATE INDEX IF NOT EXISTS findings_commit ON findings (commitHash);
+CREATE INDEX IF NOT EXISTS findings_classification ON findings (classification);
+"""
+
+QUOTED = ", ".join(f'"{column}"' for column in COLUMNS)
+UPSERT = (
+    f"INSERT INTO findings ({QUOTED}) VALUES ({', '.join('?' for _ in COLUMNS)}) "
+    "ON CONFLICT (secretGuid) DO UPDATE SET "
+    + ", ".join(f'"{column}" = excluded."{column}"' for column in COLUMNS[1:])
+)
+
+
+class FindingsStore:
+    """
+    Whitelist entries kept in a local SQLite database, as an alternative to
+    whitelist.json. Entries are written with upserts, so a run only touches the
+    rows it changes, and queries by guid, path, commit or classification use
+    an index instead of loading the whole whitelist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def _row(entry):
+        return tuple(getattr(entry, column) for column in COLUMNS)
+
+    @staticmethod
+    def _entry(row):
+        return WhitelistEntry(**dict(zip(COLUMNS, row)))
+
+    def _select(self, where="", parameters=()):
+        rows = self.connection.execute(f"SELECT {QUOTED} FROM findings {where}", parameters)
+        return {FindingsStore._entry(row) for row in rows}
+
+    def upsert(self, entries):
+        with self.connection:
+            self.connection.executemany(UPSERT, map(FindingsStore._row, entries))
+
+    def delete(self, secretGuids):
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM findings WHERE secretGuid = ?", ((guid,) for guid in secretGuids)
+            )
+
+    def write(self, entries):
+        """
+        Makes the store hold exactly `entries`, as rewriting whitelist.json would.
+        Only the rows that are new, changed or no longer reported are written.
+        """
+        rows = {entry.secretGuid: FindingsStore._row(entry) for entry in entries}
+        stored = {row[0]: row for row in self.connection.execute(f"SELECT {QUOTED} FROM findings")}
+        changed = [row for guid, row in rows.items() if stored.get(guid) != row]
+        stale = [guid for guid in stored if guid not in rows]
+        if not changed and not stale:
+            return
+        with self.connection:
+            self.connection.executemany(UPSERT, changed)
+            self.connection.executemany(
+                "DELETE FROM findings WHERE secretGuid = ?", ((guid,) for guid in stale)
+            )
+
+    def get(self, secretGuid):
+        found = self._select("WHERE secretGuid = ?", (secretGuid,))
+        return found.pop() if found else None
+
+    def find(self, path=None, commitHash=None, classification=None):
+        conditions = {"path": path, "commitHash": commitHash, "classification": classification}
+        conditions = {column: value for column, value in conditions.items() if value is not None}
+        if not conditions:
+            return self._select()
+        where = " AND ".join(f'"{column}" = ?' for column in conditions)
+        return self._select(f"WHERE {where}", tuple(conditions.values()))
+
+    def read(self, acknowledged_only=False):
+        if not acknowledged_only:
+            return self._select()
+        placeholders = ", ".join("?" for _ in Classifications.valid)
+        return self._select(f"WHERE classification IN ({placeholders})", tuple(Classifications.valid))
+
+    def import_json(self, path="whitelist.json"):
+        with open(path, "r") as whitelist:
+            self.upsert(WhitelistEntry(**entry) for entry in json.load(whitelist))
+
+    def export_json(self, path="whitelist.json"):
+        ScanResults.write_whitelist_to_disk(self.read(), path)
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM findings").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -9,11 +9,30 @@ import hashlib
 import tempfile
 import os
 import json
+import jsons
 import re
 import stat
+import shutil
+import weakref
+import threading
+import multiprocessing
+from collections import Counter, OrderedDict
+from functools import lru_cache, partial
+from itertools import chain
 from git import Repo
 from git import NULL_TREE
-from truffleHog.whitelist import WhitelistEntry, WhitelistStatistics, ScanResults, Remediation, MetricCalculation
+from truffleHog.whitelist import WhitelistStatistics, ScanResults, Remediation, MetricCalculation, Finding, StreamingStatistics, WhitelistIndex
+from truffleHog.rules import load_rules
+from truffleHog.gitlog import iter_log, parse_patch, changed_entries, RefMap, ALL_REFS, is_shallow, RevisionWalk
+from truffleHog.cache import MatchCache, blob_pair
+from truffleHog.scanstate import ScanState, whitelist_digest
+from truffleHog.store import FindingsStore
+from truffleHog.paths import PathFilter
+from truffleHog.limits import BlobLimits
+from truffleHog.prepass import plan_commits, byte_batches
+from truffleHog.clone import clone_options, mirror, source_name
+from truffleHog.batch import read_manifest, schedule
+from truffleHog.daemon import make_server, TOKEN_ENV
 from termcolor import colored
 
 import colorama
@@ -24,173 +43,248 @@ BASE64_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/
 HEX_CHARS = "1234567890abcdefABCDEF"
 
 
-def _get_regexes():
-    with open(os.path.join(os.path.dirname(__file__), "regexes.json"), "r") as f:
-        regexes = json.loads(f.read())
-
-    for key in regexes:
-        regexes[key] = re.compile(regexes[key])
-
-    return regexes
-
-
-def _exclusion_filter(path):
-    excluded_files = ["whitelist.json", "package-lock.json"]
-    for file_seg in excluded_files:
-        if file_seg in path:
-            return True
-    return False
+class RepositoryError(Exception):
+    """
+    A repository that cannot be opened, cloned or scanned.
+    """
 
 
-def _get_repo(repo_path):
+def _get_repo(repo_path, clone_cache=None, depth=None, blob_filter=None, empty=False):
+    """
+    A handle on the repository at `repo_path`, cloning it when it is a URL. An
+    already resolved handle is returned as is, so a run resolves it once. A
+    repository without commits is refused unless `empty` is set. A
+    RepositoryError naming `repo_path` is raised when there is none.
+    """
+    if hasattr(repo_path, "git_dir"):
+        return repo_path
     try:
         try:
             repo = Repo(repo_path)
         except:
-            repo = Repo(_clone_git_repo(repo_path))
+            if clone_cache:
+                repo = mirror(repo_path, clone_cache, depth, blob_filter)
+            else:
+                project_path = _clone_git_repo(repo_path, depth, blob_filter)
+                repo = Repo(project_path)
+                # The clone is removed along with the last reference to it.
+                weakref.finalize(repo, shutil.rmtree, project_path, True)
     except Exception as e:
-        print(
-            colored(
-                f"Unable to find a git repository. Are you sure {os.getcwd()} is a valid git repository?",
-                "red",
-            ),
-            file=sys.stderr,
-        )
-        sys.exit(1)
+        raise RepositoryError(
+            f"Unable to find a git repository. Are you sure {repo_path} is a valid git repository?"
+        ) from e
+    if empty:
+        return repo
     try:
         repo.iter_commits()
         return repo
     except ValueError as e:
-        print(
-            colored(
-                f"Can't operate on this repository. Is {os.getcwd()} a non-empty git repository?",
-                "red",
-            ),
-            file=sys.stderr,
-        )
-        sys.exit(1)
+        raise RepositoryError(
+            f"Can't operate on this repository. Is {repo_path} a non-empty git repository?"
+        ) from e
 
 
 
 
-def _clone_git_repo(git_url):
+def _clone_git_repo(git_url, depth=None, blob_filter=None):
     project_path = tempfile.mkdtemp()
-    Repo.clone_from(git_url, project_path)
+    try:
+        Repo.clone_from(git_url, project_path, **clone_options(depth, blob_filter))
+    except:
+        shutil.rmtree(project_path, ignore_errors=True)
+        raise
     return project_path
 
 
+@lru_cache(maxsize=None)
+def _char_ranks(iterator):
+    return {char: rank for rank, char in enumerate(iterator)}
+
+
+@lru_cache(maxsize=65536)
+def _entropy_term(count, length):
+    p_x = float(count) / length
+    return -p_x * log(p_x, 2)
+
+
 def shannon_entropy(data, iterator):
     """
     Borrowed from http://blog.dkbza.org/2007/05/scanning-data-for-entropy-anomalies.html
+
+    Characters are counted in one pass over the data, then summed in the order
+    of `iterator` so the result matches the original per-character count loop.
     """
     if not data:
         return 0
+    ranks = _char_ranks(iterator)
+    counts = Counter(data)
     entropy = 0
-    for x in iterator:
-        p_x = float(data.count(x)) / len(data)
-        if p_x > 0:
-            entropy += -p_x * log(p_x, 2)
+    for char in sorted((char for char in counts if char in ranks), key=ranks.__getitem__):
+        entropy += _entropy_term(counts[char], len(data))
     return entropy
 
 
-def get_strings_of_set(word, char_set, threshold=20):
-    count = 0
-    letters = ""
-    strings = set()
-    for char in word:
-        if char in char_set:
-            letters += char
-            count += 1
-        else:
-            if count > threshold:
-                strings.add(letters)
-            letters = ""
-            count = 0
-    if count > threshold:
-        strings.add(letters)
-    return strings
+def batch_entropy(strings, iterator):
+    """
+    Returns the entropy of every distinct string, scoring each one only once.
+    """
+    return {string: shannon_entropy(string, iterator) for string in set(strings)}
+
+
+def _run_pattern(char_set, threshold=20):
+    return re.compile(f"[{re.escape(char_set)}]{{{threshold + 1},}}")
+
 
+BASE64_RUN = _run_pattern(BASE64_CHARS)
+HEX_RUN = _run_pattern(HEX_CHARS)
 
-def entropicDiff(printableDiff, commit_time, prev_commit, path, commitHash):
-    entropicFindings = set()
+
+def iter_candidates(text):
+    """
+    Yields (char_set, start, end) for every run of more than 20 base64 or hex
+    characters in the text. Hex characters are a subset of base64, so hex runs
+    are only looked for inside the base64 runs of the single pass over the text.
+    """
+    for run in BASE64_RUN.finditer(text):
+        start, end = run.span()
+        yield BASE64_CHARS, start, end
+        for hex_run in HEX_RUN.finditer(text, start, end):
+            yield HEX_CHARS, hex_run.start(), hex_run.end()
+
+
+def find_entropy(printableDiff):
+    """
+    Returns the base64 and hex candidates of the diff whose entropy is above the
+    4.5 and 3.0 thresholds.
+    """
     stringsFound = set()
-    lines = printableDiff.split("\n")
-    for line in lines:
-        for word in line.split():
-            base64_strings = get_strings_of_set(word, BASE64_CHARS)
-            hex_strings = get_strings_of_set(word, HEX_CHARS)
-            for string in base64_strings:
-                b64Entropy = shannon_entropy(string, BASE64_CHARS)
-                if b64Entropy > 4.5:
-                    stringsFound.add(string)
-            for string in hex_strings:
-                hexEntropy = shannon_entropy(string, HEX_CHARS)
-                if hexEntropy > 3:
-                    stringsFound.add(string)
-    for string in stringsFound:
-        entropicFindings.add(
-            WhitelistEntry(
-                commit=prev_commit.message.replace("\n", ""),
-                commitAuthor=prev_commit.author.email,
-                commitHash=prev_commit.hexsha,
-                date=commit_time,
-                path=path,
-                reason="High Entropy",
-                stringDetected=string,
-            )
-        )
+    base64_strings = set()
+    hex_strings = set()
+    for char_set, start, end in iter_candidates(printableDiff):
+        if char_set is BASE64_CHARS:
+            base64_strings.add(printableDiff[start:end])
+        else:
+            hex_strings.add(printableDiff[start:end])
+    for string, b64Entropy in batch_entropy(base64_strings, BASE64_CHARS).items():
+        if b64Entropy > 4.5:
+            stringsFound.add(string)
+    for string, hexEntropy in batch_entropy(hex_strings, HEX_CHARS).items():
+        if hexEntropy > 3:
+            stringsFound.add(string)
+    return stringsFound
+
+
+def find_matches(printableDiff):
+    """
+    Returns the raw (reason, string) matches of the regex rules and of the
+    entropy check, before any commit metadata is attached.
+    """
+    regex_matches = tuple(load_rules().scan(printableDiff))
+    entropic_matches = tuple(
+        ("High Entropy", string) for string in find_entropy(printableDiff)
+    )
+    return regex_matches, entropic_matches
 
-    return entropicFindings
-
-
-def regex_check(printableDiff, commit_time, prev_commit, path, commitHash):
-    regex_matches = set()
-    regexes = _get_regexes()
-    for key in regexes:
-        found_strings = regexes[key].findall(printableDiff, re.MULTILINE)
-
-        for string in found_strings:
-            regex_matches.add(
-                WhitelistEntry(
-                    commit=prev_commit.message.replace("\n", ""),
-                    commitAuthor=prev_commit.author.email,
-                    commitHash=prev_commit.hexsha,
-                    date=commit_time,
-                    path=path,
-                    reason=key,
-                    stringDetected=string,
-                )
-            )
-    return regex_matches
 
+default_limits = BlobLimits()
 
-def diff_worker(diff, curr_commit, prev_commit, commitHash):
+
+def scan_patch(patch, limits=default_limits):
+    """
+    find_matches on the decoded patch. A patch over the chunk size is decoded
+    and scanned one overlapping window at a time, so the decoded text and the
+    matching work stay bounded by the window, and the matches found twice in an
+    overlap are reported once. The patch bytes are held whole.
+    """
+    if len(patch) <= limits.chunk_size:
+        return find_matches(patch.decode("utf-8", errors="replace"))
+    regex_matches = {}
+    entropic_matches = {}
+    for window in limits.windows(patch):
+        window_regex, window_entropic = find_matches(window.decode("utf-8", errors="replace"))
+        regex_matches.update(dict.fromkeys(window_regex))
+        entropic_matches.update(dict.fromkeys(window_entropic))
+    return tuple(regex_matches), tuple(entropic_matches)
+
+
+def report_skipped(commitHash, path, reason):
+    print(colored(f"Skipped {path} in {commitHash}: {reason}", "yellow"), file=sys.stderr)
+
+
+ADDED_LINE = re.compile(rb"^\+.*$", re.MULTILINE)
+
+
+def added_lines(patch):
+    """
+    Returns only the added lines of a patch, with their leading "+", so the
+    detectors report the same strings (and secretGuids) as on the whole patch.
+    """
+    return b"\n".join(ADDED_LINE.findall(patch))
+
+
+match_cache = MatchCache()
+default_path_filter = PathFilter()
+
+
+def diff_worker(
+    diff,
+    curr_commit,
+    prev_commit,
+    commitHash,
+    cache=match_cache,
+    added_only=False,
+    path_filter=default_path_filter,
+    limits=default_limits,
+):
     issues = set()
     for blob in diff:
         path = blob.b_path if blob.b_path else blob.a_path
-        if _exclusion_filter(path):
+        if not path_filter.included(path):
             continue
-        printableDiff = blob.diff.decode("utf-8", errors="replace")
-        if printableDiff.startswith("Binary files"):
+        # Checked before the cache, which is keyed by blob pair, not path.
+        skipped = limits.skip_path(path)
+        if skipped:
+            report_skipped(commitHash, path, skipped)
             continue
-        commit_time = datetime.datetime.fromtimestamp(
-            prev_commit.committed_date
-        ).strftime("%Y-%m-%d %H:%M:%S")
-
-        entropic_results = entropicDiff(
-            printableDiff, commit_time, curr_commit, path, commitHash
+        key = blob_pair(blob)
+        if key:
+            key = key + (added_only, limits, limits.minifiable(path))
+        matches = cache.get(key) if key else None
+        if matches is None:
+            skipped = None
+            if blob.diff.startswith(b"Binary files"):
+                matches = ((), ())
+            else:
+                patch = added_lines(blob.diff) if added_only else blob.diff
+                skipped = limits.skip_reason(path, patch)
+                if skipped:
+                    report_skipped(commitHash, path, skipped)
+                    matches = ((), ())
+                else:
+                    matches = scan_patch(patch, limits)
+            # Skips are not cached, so each one is reported.
+            if key and not skipped:
+                cache.put(key, matches)
+
+        regex_matches, entropic_matches = matches
+        issues.update(
+            Finding(commitHash, path, reason, string) for reason, string in regex_matches
         )
-
-        found_regexes = regex_check(
-            printableDiff, commit_time, curr_commit, path, commitHash
+        issues.update(
+            Finding(commitHash, path, reason, string) for reason, string in entropic_matches
         )
-        issues = issues.union(found_regexes)
-        issues = issues.union(entropic_results)
 
     return issues
 
 
-def scan_commit(commit, repo):
+def scan_commit(
+    commit,
+    repo,
+    added_only=False,
+    path_filter=default_path_filter,
+    limits=default_limits,
+    exclude=(),
+):
     curr_commit = repo.commit(commit)
     try:
         prev_commit = curr_commit.parents[0]
@@ -198,19 +292,155 @@ def scan_commit(commit, repo):
         prev_commit = curr_commit
 
     commitHash = curr_commit.hexsha
-    diff = prev_commit.diff(curr_commit, create_patch=True)
+    paths = path_filter.pathspecs()
+    paths.extend(f":(top,exclude,literal){path}" for path in exclude)
+    diff = prev_commit.diff(curr_commit, paths, create_patch=True)
 
     diff = [blob for blob in diff.iter_change_type("M")] + [
         blob for blob in diff.iter_change_type("A")
     ]
-    commit_results = diff_worker(diff, curr_commit, prev_commit, commitHash)
+    commit_results = diff_worker(
+        diff,
+        curr_commit,
+        prev_commit,
+        commitHash,
+        added_only=added_only,
+        path_filter=path_filter,
+        limits=limits,
+    )
 
     return commit_results
 
-def find_strings(repo_path, commit=None):
-    output = set()
-    repo = _get_repo(repo_path)
-    commits = repo.iter_commits()
+
+def scan_planned_commit(
+    plan, repo, added_only=False, path_filter=default_path_filter, limits=default_limits
+):
+    """
+    scan_commit on a commit planned by the pre-pass: the files it dropped are
+    left out of the diff, and a commit with nothing left to scan is not diffed.
+    """
+    for path, reason in plan.dropped:
+        report_skipped(plan.hexsha, path, reason)
+    if not plan.entries:
+        return set()
+    exclude = [path for path, _ in plan.dropped]
+    return scan_commit(plan.hexsha, repo, added_only, path_filter, limits, exclude)
+
+
+def scan_logged_commit(
+    logged_commit, added_only=False, path_filter=default_path_filter, limits=default_limits
+):
+    curr_commit, prev_commit, entries = logged_commit
+    return diff_worker(
+        changed_entries(entries),
+        curr_commit,
+        prev_commit,
+        curr_commit.hexsha,
+        added_only=added_only,
+        path_filter=path_filter,
+        limits=limits,
+    )
+
+
+STAGED = "STAGED"
+
+
+def scan_staged(repo, path_filter=default_path_filter, limits=default_limits):
+    """
+    The findings of the changes staged in the index, diffed against HEAD by a
+    single `git diff --cached`. Only added lines are scanned, so unstaging or
+    removing a secret is never reported as adding one.
+    """
+    git = repo.git(c=["diff.noprefix=false", "diff.mnemonicPrefix=false"])
+    patch = git.diff(
+        "--cached",
+        "-M",
+        "--full-index",
+        "--abbrev=40",
+        "--no-textconv",
+        "--no-ext-diff",
+        "--no-color",
+        "--",
+        *path_filter.pathspecs(),
+        stdout_as_string=False,
+    )
+    return diff_worker(
+        changed_entries(parse_patch(patch)),
+        None,
+        None,
+        STAGED,
+        added_only=True,
+        path_filter=path_filter,
+        limits=limits,
+    )
+
+
+_worker_repo = None
+
+
+def _init_worker(repo_path):
+    global _worker_repo
+    _worker_repo = Repo(repo_path)
+
+
+def _scan_batch_in_worker(
+    plans, added_only=False, path_filter=default_path_filter, limits=default_limits
+):
+    return [
+        scan_planned_commit(plan, _worker_repo, added_only, path_filter, limits)
+        for plan in plans
+    ]
+
+
+def _scan_in_parallel(scanner, items, jobs, chunksize, **pool_options):
+    """
+    Spreads the items over a pool of worker processes. Results come back in the
+    order of the items, as in a serial scan.
+    """
+    with multiprocessing.Pool(jobs, **pool_options) as pool:
+        for commit_diff in pool.imap(scanner, items, chunksize):
+            yield commit_diff
+
+
+def _commit_time(commit):
+    return datetime.datetime.fromtimestamp(commit.committed_date).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+
+
+def _commit_metadata(repo, commitHash):
+    """
+    The commit message, author and date recorded on each of a commit's findings.
+    As in scan_commit, the date is the one of the commit's first parent.
+    """
+    commit = repo.commit(commitHash)
+    prev_commit = commit.parents[0] if commit.parents else commit
+    return commit.message.replace("\n", ""), commit.author.email, _commit_time(prev_commit)
+
+
+def _iter_history(repo, all_refs=False):
+    if all_refs:
+        return repo.iter_commits("HEAD", branches=True, tags=True, remotes=True)
+    return repo.iter_commits()
+
+
+def annotate_refs(repo, entries):
+    """
+    Records on each entry the branches and tags whose history contains its commit.
+    """
+    refs = RefMap(repo)
+    for entry in entries:
+        entry.refs = refs[entry.commitHash]
+
+
+def _scan_history(
+    repo, commit, jobs, stream, skip, added_only, all_refs, path_filter, limits, walk=None
+):
+    """
+    Yields the set of findings of every commit to scan, in history order.
+    """
+    paths = path_filter.pathspecs()
+    commits = _iter_history(repo, all_refs)
 
     if commit:
         try:
@@ -220,20 +450,195 @@ def find_strings(repo_path, commit=None):
             sys.exit(0)
 
         commits = [commit]
+    elif walk is not None:
+        try:
+            commits = walk.resolve(repo)
+        except:
+            print(colored(f"Could not resolve {walk}", color="red"), file=sys.stderr),
+            sys.exit(0)
+        commits = [c for c in commits if c not in skip]
+    elif skip:
+        commits = [c.hexsha for c in commits if c.hexsha not in skip]
+
+    if stream:
+        if commit:
+            logged_commits = iter_log(repo, commit, max_count=1, paths=paths)
+        elif skip or walk is not None:
+            logged_commits = iter_log(repo, commits=commits, paths=paths)
+        elif all_refs:
+            logged_commits = iter_log(repo, *ALL_REFS, paths=paths)
+        else:
+            logged_commits = iter_log(repo, paths=paths)
+        scanner = partial(
+            scan_logged_commit, added_only=added_only, path_filter=path_filter, limits=limits
+        )
+        if jobs > 1:
+            return _scan_in_parallel(scanner, logged_commits, jobs, 16)
+        return map(scanner, logged_commits)
+
+    if jobs > 1 or limits.max_blob_size is not None or is_shallow(repo):
+        # The pre-pass reads only change metadata, so oversized files are
+        # dropped and commits weighed before any patch text is produced. It
+        # also sees the oldest commits of a shallow clone as root commits.
+        commits = [c.hexsha if hasattr(c, "hexsha") else c for c in commits]
+        plans = plan_commits(repo, commits, path_filter, limits.max_blob_size)
+        if jobs > 1:
+            # Each worker opens its own repository handle once.
+            batches = _scan_in_parallel(
+                partial(
+                    _scan_batch_in_worker,
+                    added_only=added_only,
+                    path_filter=path_filter,
+                    limits=limits,
+                ),
+                byte_batches(plans, jobs * 4),
+                jobs,
+                1,
+                initializer=_init_worker,
+                initargs=(repo.git_dir,),
+            )
+            return chain.from_iterable(batches)
+        return (
+            scan_planned_commit(plan, repo, added_only, path_filter, limits)
+            for plan in plans
+        )
+    return (
+        scan_commit(commit, repo, added_only, path_filter, limits) for commit in commits
+    )
 
-    for commit in commits:
-        commit_diff = scan_commit(commit, repo)
-        output = output.union(commit_diff)
+
+def iter_findings(
+    repo_path,
+    commit=None,
+    jobs=1,
+    stream=False,
+    skip=(),
+    added_only=False,
+    all_refs=False,
+    path_filter=default_path_filter,
+    limits=default_limits,
+    walk=None,
+):
+    """
+    Yields every finding as a WhitelistEntry as soon as the commit holding it
+    has been scanned. Findings are unique within a commit and secretGuids
+    include the commit, so the stream never repeats a finding.
+
+    A RevisionWalk as `walk` scans only the commits of that walk.
+    """
+    repo = _get_repo(repo_path)
+    refs = RefMap(repo) if all_refs else None
+    commit_diffs = _scan_history(
+        repo, commit, jobs, stream, skip, added_only, all_refs, path_filter, limits, walk
+    )
+    for commit_diff in commit_diffs:
+        metadata = None
+        for finding in commit_diff:
+            if metadata is None:
+                metadata = _commit_metadata(repo, finding.commitHash)
+            entry = finding.to_whitelist_entry(*metadata)
+            if refs is not None:
+                entry.refs = refs[entry.commitHash]
+            yield entry
+
+
+def find_strings(repo_path, commit=None, **options):
+    output = set()
+    output.update(iter_findings(repo_path, commit=commit, **options))
     return output
 
 
+def _scan_options(args):
+    walk = RevisionWalk.from_options(
+        args.commit,
+        since_commit=getattr(args, "since_commit", None),
+        max_depth=getattr(args, "max_depth", None),
+        since_date=getattr(args, "since_date", None),
+        all_refs=getattr(args, "all_refs", False),
+    )
+    return {
+        # A walk has the commit as its head.
+        "commit": args.commit if walk is None else None,
+        "walk": walk,
+        "jobs": getattr(args, "jobs", 1),
+        "stream": getattr(args, "stream_log", False),
+        "added_only": getattr(args, "added_only", False),
+        "all_refs": getattr(args, "all_refs", False),
+        "path_filter": PathFilter.from_files(
+            getattr(args, "include_paths", None), getattr(args, "exclude_paths", None)
+        ),
+        "limits": BlobLimits(
+            max_blob_size=getattr(args, "max_blob_size", None),
+            skip_generated=getattr(args, "skip_generated", False),
+        ),
+    }
+
+
+def _scan_digest(args):
+    """
+    Identifies what a scan reports: the rule set and the detector options.
+    """
+    digest = load_rules().digest
+    if getattr(args, "added_only", False):
+        digest = hashlib.sha256(f"{digest}:added_only".encode("utf-8")).hexdigest()
+    options = _scan_options(args)
+    if options["path_filter"].include or options["path_filter"].exclude:
+        digest = hashlib.sha256(f"{digest}:{options['path_filter']}".encode("utf-8")).hexdigest()
+    if options["limits"] != default_limits:
+        digest = hashlib.sha256(f"{digest}:{options['limits']}".encode("utf-8")).hexdigest()
+    return digest
+
+
+def _clone_options(args):
+    return {
+        "clone_cache": getattr(args, "clone_cache", None),
+        "depth": getattr(args, "clone_depth", None),
+        "blob_filter": getattr(args, "clone_filter", None),
+    }
+
+
+def _resolve_repo(args, empty=False):
+    """
+    The --repo_path repository of a single-repository mode, exiting when it
+    cannot be opened.
+    """
+    try:
+        return _get_repo(args.repo_path, empty=empty, **_clone_options(args))
+    except RepositoryError as e:
+        print(colored(str(e), "red"), file=sys.stderr)
+        sys.exit(1)
+
+
+def _open_store(args):
+    path = getattr(args, "store", None)
+    return FindingsStore(path) if path else None
+
+
 def console_mode(args):
-    scan = ScanResults()
+    scan = ScanResults(store=_open_store(args))
 
     failure_message = None
-    repo = _get_repo(repo_path=args.repo_path)
-
-    scan.possible_secrets = find_strings(repo_path=args.repo_path, commit=args.commit)
+    repo = _resolve_repo(args)
+
+    options = _scan_options(args)
+    if getattr(args, "incremental", False) and not args.commit and options["walk"] is None:
+        recorded = scan.read_whitelist()
+        state = ScanState.read(_scan_digest(args), whitelist_digest=whitelist_digest(recorded))
+        history = {c.hexsha for c in _iter_history(repo, options["all_refs"])}
+        scan.possible_secrets = find_strings(repo, skip=state.commits, **options)
+        # Findings of commits scanned by earlier runs are carried over, unless
+        # their commit has left the history.
+        carried_over = {
+            entry
+            for entry in recorded
+            if state.is_scanned(entry.commitHash) and entry.commitHash in history
+        }
+        if options["all_refs"]:
+            annotate_refs(repo, carried_over)
+        scan.possible_secrets |= carried_over
+    else:
+        state = None
+        scan.possible_secrets = find_strings(repo, **options)
     print(
         colored(f"Working with project path {repo.git_dir}", "green"), file=sys.stderr
     )
@@ -241,21 +646,60 @@ def console_mode(args):
     scan.reconcile_secrets()
     wls = WhitelistStatistics(scan.reconciled_results, args.pipeline_mode)
     print(colored(wls, "green"))
-    scan.write_whitelist_to_disk(scan.reconciled_results)
+    scan.write_whitelist(scan.reconciled_results)
+    if state is not None:
+        state.write(history, whitelist_digest=whitelist_digest(scan.reconciled_results))
 
     return wls
 
 
+def stream_pipeline(args, out=sys.stdout):
+    """
+    Writes each finding as a JSON line as soon as it is found, then one summary
+    line. Only the summary counters, and the distinct strings and files they
+    count, are kept in memory.
+    """
+    options = _scan_options(args)
+    strip_attr = () if options["all_refs"] else "refs"
+    stats = StreamingStatistics()
+    known = WhitelistIndex(ScanResults(store=_open_store(args)).known_secrets)
+    repo = _resolve_repo(args)
+
+    for entry in iter_findings(repo, **options):
+        if entry in known:
+            continue
+        stats.add(entry)
+        record = {"type": "finding", **jsons.dump(entry, strip_attr=strip_attr)}
+        print(json.dumps(record), file=out, flush=True)
+
+    if options["walk"] is not None:
+        summary = stats.to_dict_per_range(repo, options["walk"])
+    elif args.commit:
+        summary = stats.to_dict_per_commit(repo, args.commit)
+    else:
+        summary = stats.to_dict()
+    print(json.dumps({"type": "summary", **summary}), file=out, flush=True)
+    return stats
+
+
 def pipeline_mode(args):
-    scan = ScanResults()
+    scan = ScanResults(store=_open_store(args))
 
-    repo = _get_repo(repo_path=args.repo_path)
+    repo = _resolve_repo(args)
 
-    scan.possible_secrets = find_strings(repo_path=args.repo_path, commit=args.commit)
+    # Secrets already acknowledged in the whitelist are not reported.
+    known = WhitelistIndex(scan.known_secrets)
+    options = _scan_options(args)
+    scan.possible_secrets = {
+        entry for entry in iter_findings(repo, **options) if entry not in known
+    }
 
     wls = WhitelistStatistics(scan.possible_secrets, pipeline_mode=True)
 
-    if args.commit:
+    if options["walk"] is not None:
+        # The whole range is reported at once.
+        results = json.dumps(wls.to_dict_per_range(repo, options["walk"]))
+    elif args.commit:
         results = json.dumps(wls.to_dict_per_commit(repo, args.commit))
     else:
         results = json.dumps(wls.to_dict())
@@ -264,6 +708,242 @@ def pipeline_mode(args):
     return wls
 
 
+def _scan_repository(source, repo_path, options, output):
+    """
+    Scans one repository of a batch, in a worker process, and writes its
+    findings to `output`. Secrets acknowledged in the whitelist.json at the
+    repository's HEAD are left out. Returns the repository's summary.
+    """
+    repo = _get_repo(repo_path)
+    whitelist = MetricCalculation.parse_whitelist_blob(
+        MetricCalculation.whitelist_blob("HEAD", repo), repo
+    )
+    known = WhitelistIndex(entry for entry in whitelist if entry.is_acknowledged())
+    secrets = [entry for entry in find_strings(repo, **options) if entry not in known]
+
+    wls = WhitelistStatistics(secrets, pipeline_mode=True)
+    path = os.path.join(output, f"{source_name(source)}.json")
+    with open(path, "w") as results:
+        findings = jsons.dump(
+            sorted(secrets, key=lambda entry: entry.secretGuid),
+            strip_attr=() if options["all_refs"] else "refs",
+        )
+        json.dump({"repository": source, **wls.to_dict(), "findings": findings}, results, indent=4)
+    return {"repository": source, "results": path, **wls.to_dict()}
+
+
+def batch_mode(args):
+    """
+    Scans every repository of the --batch manifest, --batch_jobs at a time, and writes
+    a results file per repository plus summary.json to --batch_output.
+    """
+    sources = read_manifest(args.batch)
+    output = getattr(args, "batch_output", None) or "trufflehog-batch"
+    os.makedirs(output, exist_ok=True)
+    # The repositories are scanned in parallel, each by a single process.
+    options = {**_scan_options(args), "jobs": 1}
+    # Compiled once here, the rules are inherited by every forked worker.
+    load_rules()
+
+    summaries = []
+    failures = []
+    for source, summary, error in schedule(
+        sources,
+        partial(_get_repo, **_clone_options(args)),
+        partial(_scan_repository, options=options, output=output),
+        fetchers=getattr(args, "batch_fetchers", 4),
+        jobs=getattr(args, "batch_jobs", None),
+    ):
+        if error is not None:
+            print(colored(f"Unable to scan {source}: {error}", "red"), file=sys.stderr)
+            failures.append({"repository": source, "error": str(error) or type(error).__name__})
+        else:
+            print(colored(f"Scanned {source}: {summary['Total Strings']} strings", "green"), file=sys.stderr)
+            summaries.append(summary)
+
+    combined = {
+        "Repositories": len(sources),
+        "Failed": len(failures),
+        "Total Strings": sum(summary["Total Strings"] for summary in summaries),
+        "results": sorted(summaries, key=lambda summary: summary["repository"]),
+        "failures": sorted(failures, key=lambda failure: failure["repository"]),
+    }
+    with open(os.path.join(output, "summary.json"), "w") as summary_file:
+        json.dump(combined, summary_file, indent=4)
+    return combined
+
+
+# What a pre-commit hook may add to a commit, from process start to exit code,
+# for a typical commit of up to 20 files and 100 KB of changes.
+STAGED_LATENCY_TARGET = 1.0
+
+
+def staged_secrets(repo, known, path_filter=default_path_filter, limits=default_limits):
+    """
+    The secrets in the staged changes that the acknowledged entries in `known`
+    do not cover, ordered by path. A secret acknowledged anywhere in the
+    history is not reported again when it is staged in another place.
+    """
+    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    secrets = []
+    for finding in scan_staged(repo, path_filter, limits):
+        entry = finding.to_whitelist_entry("", "", date)
+        if not known.with_string(entry.stringDetected):
+            secrets.append(entry)
+    return sorted(secrets, key=lambda entry: (entry.path, entry.stringDetected))
+
+
+def staged_mode(args):
+    """
+    Reports the secrets in the staged changes that the whitelist has not
+    acknowledged.
+    """
+    # The first commit is staged in a repository without commits.
+    repo = _resolve_repo(args, empty=True)
+    options = _scan_options(args)
+    known = WhitelistIndex(ScanResults(store=_open_store(args)).known_secrets)
+    secrets = staged_secrets(repo, known, options["path_filter"], options["limits"])
+
+    for entry in secrets:
+        print(colored(f"{entry.path}: {entry.reason}: {entry.stringDetected}", "red"))
+    if secrets:
+        print(
+            colored(
+                f"Secrets staged: {len(secrets)}. Remove them, or acknowledge them in the whitelist, before committing",
+                "red",
+            )
+        )
+    return secrets
+
+
+class ScanService:
+    """
+    Answers the scan requests of --daemon. The rules are compiled when it
+    starts, and repository handles and parsed whitelists are kept between
+    requests, so a request pays only for its own diff. Scans run one at a
+    time: GitPython handles and the match cache are not safe to share between
+    threads.
+
+    A request names the "repo" and the "scan": a "commit", a "range", or the
+    "staged" changes. Commit and range scans also take the range and detector
+    options of the command line, such as since_commit or added_only.
+
+    The "repo" must be a local path unless `allow_urls` is set, so a client
+    cannot have the daemon clone whatever it names. The `max_repos` most
+    recently used handles are kept; an evicted one is closed, which removes a
+    temporary clone.
+    """
+
+    OPTIONS = (
+        "since_commit",
+        "max_depth",
+        "since_date",
+        "added_only",
+        "all_refs",
+        "include_paths",
+        "exclude_paths",
+        "max_blob_size",
+        "skip_generated",
+    )
+
+    def __init__(self, clone_options=None, allow_urls=False, max_repos=16):
+        self.clone_options = clone_options or {}
+        self.allow_urls = allow_urls
+        self.max_repos = max_repos
+        self.repos = OrderedDict()
+        self.whitelists = {}
+        self.lock = threading.Lock()
+        load_rules()
+
+    def repo(self, repo_path):
+        if os.path.isdir(repo_path):
+            key = os.path.realpath(repo_path)
+        elif self.allow_urls:
+            key = repo_path
+        else:
+            raise ValueError(f"{repo_path} is not a local directory, and the daemon does not clone URLs")
+        if key not in self.repos:
+            self.repos[key] = _get_repo(repo_path, empty=True, **self.clone_options)
+            if len(self.repos) > self.max_repos:
+                self.release(self.repos.popitem(last=False)[1])
+        self.repos.move_to_end(key)
+        return self.repos[key]
+
+    def release(self, repo):
+        self.whitelists.pop(self.whitelist_path(repo), None)
+        repo.close()
+
+    def close(self):
+        while self.repos:
+            self.release(self.repos.popitem()[1])
+
+    @staticmethod
+    def whitelist_path(repo):
+        return os.path.join(repo.working_tree_dir or repo.git_dir, "whitelist.json")
+
+    def known_secrets(self, repo):
+        """
+        The acknowledged entries of the repository's whitelist.json, parsed
+        again only when the file changes.
+        """
+        path = self.whitelist_path(repo)
+        try:
+            file_stat = os.stat(path)
+            version = (file_stat.st_mtime_ns, file_stat.st_size)
+        except FileNotFoundError:
+            return WhitelistIndex()
+        cached = self.whitelists.get(path)
+        if cached is None or cached[0] != version:
+            entries = ScanResults.read_whitelist_from_disk(acknowledged_only=True, path=path)
+            cached = self.whitelists[path] = (version, WhitelistIndex(entries))
+        return cached[1]
+
+    def handle(self, request):
+        scan = request.get("scan")
+        if scan not in ("commit", "range", "staged"):
+            raise ValueError(f"Unknown scan {scan!r}: expected commit, range or staged")
+        options = {key: request[key] for key in self.OPTIONS if key in request}
+        args = argparse.Namespace(commit=request.get(scan), **options)
+        with self.lock:
+            repo = self.repo(request.get("repo", "."))
+            known = self.known_secrets(repo)
+            options = _scan_options(args)
+            if scan == "staged":
+                secrets = staged_secrets(repo, known, options["path_filter"], options["limits"])
+                return {
+                    "ok": True,
+                    "scan": scan,
+                    "totalStrings": len(secrets),
+                    "findings": jsons.dump(secrets, strip_attr="refs"),
+                }
+
+            if not args.commit:
+                raise ValueError(f"A {scan} scan needs a {scan!r}")
+            try:
+                secrets = {
+                    entry for entry in iter_findings(repo, **options) if entry not in known
+                }
+            except SystemExit:
+                raise ValueError(f"Could not find {args.commit}")
+            wls = WhitelistStatistics(secrets, pipeline_mode=True)
+            if options["walk"] is not None:
+                return {"ok": True, "scan": scan, **wls.to_dict_per_range(repo, options["walk"])}
+            return {"ok": True, "scan": scan, **wls.to_dict_per_commit(repo, args.commit)}
+
+
+def daemon_mode(args):
+    service = ScanService(_clone_options(args), getattr(args, "daemon_allow_urls", False))
+    server = make_server(args.daemon, service.handle, os.environ.get(TOKEN_ENV))
+    print(colored(f"Listening on {args.daemon}", "green"), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
 def exit_code(output, pipeline_mode=False):
     if pipeline_mode:
         sys.exit(0)
@@ -293,37 +973,213 @@ def main(*args, **kwargs):
     parser.add_argument(
         "--repo_path", type=str, default=".", help="File path to git project "
     )
-    parser.add_argument("--commit", type=str, help="Commit SHA of git commit to scan")
-    parser.add_argument("--metrics", help="calculates a metric for the given commit", action="store_true")
+    parser.add_argument(
+        "--commit",
+        type=str,
+        help="Commit SHA of git commit to scan, or a base..head range of commits to scan",
+    )
+    parser.add_argument(
+        "--since_commit",
+        type=str,
+        help="Only scan commits that are not in the history of this commit",
+    )
+    parser.add_argument(
+        "--max_depth",
+        type=int,
+        help="Scan at most this many commits, newest first",
+    )
+    parser.add_argument(
+        "--since_date",
+        type=str,
+        help='Only scan commits committed after this date, such as "2 weeks ago" or 2024-01-31',
+    )
+    parser.add_argument(
+        "-i",
+        "--include_paths",
+        type=str,
+        help='File with regular expressions (one per line), at least one of which must match a Git object path in order for it to be scanned; lines starting with "#" are treated as comments and are ignored',
+    )
+    parser.add_argument(
+        "-x",
+        "--exclude_paths",
+        type=str,
+        help='File with regular expressions (one per line), none of which may match a Git object path in order for it to be scanned; lines starting with "#" are treated as comments and are ignored',
+    )
+    parser.add_argument(
+        "--clone_cache",
+        type=str,
+        help="Directory of bare mirrors of the remote repositories scanned; a URL is cloned once and later runs only fetch its new commits",
+    )
+    parser.add_argument(
+        "--clone_depth",
+        type=int,
+        help="Clone only this many commits of each branch of a remote repository",
+    )
+    parser.add_argument(
+        "--clone_filter",
+        type=str,
+        help="Partial clone filter for remote repositories, such as blob:none; blobs are then fetched as they are diffed",
+    )
+    parser.add_argument(
+        "--max_blob_size",
+        type=int,
+        help="Skip, and report as skipped, any file larger than this many bytes, or whose patch is; files are weighed before they are diffed",
+    )
+    parser.add_argument(
+        "--skip_generated",
+        help="Skip, and report as skipped, minified and generated files",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to scan commits in parallel",
+    )
+    parser.add_argument(
+        "--stream_log",
+        help="Read the history from one streaming `git log -p` process instead of diffing each commit",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Only scan commits not recorded in .trufflehog_state.json by an earlier run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--added_only",
+        help="Only scan the lines added by each diff, skipping context and removed lines",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--all_refs",
+        help="Scan every commit reachable from any branch or tag once, and report the refs holding each finding",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="calculates a metric for the given commit, or for every whitelist revision in a --commit range (base..head) or in the whole history",
+        action="store_true",
+    )
     parser.add_argument(
         "--remediate",
         help="Interactive mode for reconciling secrets",
         action="store_true",
     )
 
+    parser.add_argument(
+        "--daemon",
+        type=str,
+        help='Serve JSON scan requests, one per line, on a Unix socket path or a localhost [HOST:]PORT, keeping rules and repositories loaded; a port needs a token in TRUFFLEHOG_DAEMON_TOKEN, which requests must carry',
+    )
+    parser.add_argument(
+        "--daemon_allow_urls",
+        help="Let --daemon requests name repository URLs, which the daemon then clones",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        help='File listing the repository paths or URLs to scan, one per line; lines starting with "#" are treated as comments and are ignored',
+    )
+    parser.add_argument(
+        "--batch_output",
+        type=str,
+        default="trufflehog-batch",
+        help="Directory --batch writes a results file per repository and summary.json to",
+    )
+    parser.add_argument(
+        "--batch_fetchers",
+        type=int,
+        default=4,
+        help="Number of repositories --batch clones or fetches at once, while --batch_jobs repositories are scanned",
+    )
+    parser.add_argument(
+        "--batch_jobs",
+        type=int,
+        help="Number of repositories --batch scans at once, one worker process each; defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--staged",
+        help="Scan only the changes staged for the next commit, for use in a pre-commit hook",
+        action="store_true",
+    )
     parser.add_argument(
         "--pipeline_mode",
         help="Flags that secrets should not be output and that results are directed to stderr.",
         action="store_true",
     )
+    parser.add_argument(
+        "--store",
+        type=str,
+        help="Keep the whitelist in this SQLite database instead of whitelist.json",
+    )
+    parser.add_argument(
+        "--import_whitelist",
+        type=str,
+        help="Upsert the entries of this whitelist JSON file into the --store database, then exit",
+    )
+    parser.add_argument(
+        "--export_whitelist",
+        type=str,
+        help="Write the --store database out to this whitelist JSON file, then exit",
+    )
+    parser.add_argument(
+        "--jsonl",
+        help="With --pipeline_mode, write each finding as a JSON line as soon as it is found, followed by a summary line; only the distinct strings and files found are kept for the summary",
+        action="store_true",
+    )
 
     args = parser.parse_args()
 
-    if args.metrics and args.commit:
+    if args.daemon:
         try:
-            repo = _get_repo(args.repo_path)
+            daemon_mode(args)
+        except ValueError as e:
+            print(colored(f"Unable to listen on {args.daemon}: {e}", "red"), file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.metrics:
+        try:
+            repo = _resolve_repo(args)
         except Exception as e:
             print(e)
         try:
-            MetricCalculation.dump_json(args.commit, repo)
+            if args.commit and ".." not in args.commit:
+                MetricCalculation.dump_json(args.commit, repo)
+            else:
+                MetricCalculation.dump_json_range(args.commit or "HEAD", repo)
         except Exception as e:
             print(e)
         sys.exit(0)
 
+    if args.import_whitelist or args.export_whitelist:
+        if not args.store:
+            print(colored("--import_whitelist and --export_whitelist need --store", "red"), file=sys.stderr)
+            sys.exit(1)
+        store = _open_store(args)
+        if args.import_whitelist:
+            store.import_json(args.import_whitelist)
+        if args.export_whitelist:
+            store.export_json(args.export_whitelist)
+        sys.exit(0)
+
     if args.remediate:
-        Remediation.remediate_secrets()
+        Remediation.remediate_secrets(_open_store(args))
         sys.exit(0)
 
+    if args.staged:
+        sys.exit(1 if staged_mode(args) else 0)
+
+    if args.batch:
+        combined = batch_mode(args)
+        sys.exit(1 if combined["Failed"] or combined["Total Strings"] else 0)
+
+    if args.pipeline_mode and args.jsonl:
+        stream_pipeline(args)
+        exit_code(None, pipeline_mode=True)
+
     if args.pipeline_mode:
         wls = pipeline_mode(args)
         exit_code(wls.whitelist_object, pipeline_mode=True)
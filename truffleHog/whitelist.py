@@ -1,3 +1,4 @@
+import os
 import sys
 import json
 import hashlib
@@ -5,6 +6,7 @@ import jsons
 import datetime
 from itertools import groupby
 from collections import Counter
+from functools import lru_cache
 from termcolor import colored
 import colorama
 from enum import Enum
@@ -18,46 +20,128 @@ class Classifications:
 
 
 
+class WhitelistIndex:
+    """
+    Whitelist entries indexed by secretGuid and by stringDetected, so checking a
+    finding or reclassifying a string is a single dict lookup rather than a walk
+    of the whole whitelist.
+    """
+
+    def __init__(self, entries=()):
+        self.by_guid = {}
+        self.by_string = {}
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        if entry.secretGuid in self.by_guid:
+            return
+        self.by_guid[entry.secretGuid] = entry
+        self.by_string.setdefault(entry.stringDetected, []).append(entry)
+
+    def get(self, secretGuid):
+        return self.by_guid.get(secretGuid)
+
+    def with_string(self, stringDetected):
+        return self.by_string.get(stringDetected, [])
+
+    def __contains__(self, entry):
+        return entry.secretGuid in self.by_guid
+
+    def __iter__(self):
+        return iter(self.by_guid.values())
+
+    def __len__(self):
+        return len(self.by_guid)
+
+
 class ScanResults:
-    def __init__(self, **kwargs):
+    def __init__(self, store=None, **kwargs):
+        self.store = store
         self.possible_secrets = set()
-        self.known_secrets = {
-            result
-            for result in ScanResults.read_whitelist_from_disk()
-            if result.is_acknowledged() == True
-        }
+        self.known_secrets = self.read_whitelist(acknowledged_only=True)
         self.reconciled_results = set()
 
+    def read_whitelist(self, acknowledged_only=False):
+        if self.store is not None:
+            return self.store.read(acknowledged_only)
+        return ScanResults.read_whitelist_from_disk(acknowledged_only)
+
+    def write_whitelist(self, scan_results):
+        if self.store is not None:
+            self.store.write(scan_results)
+        else:
+            ScanResults.write_whitelist_to_disk(scan_results)
+
     def reconcile_secrets(self):
-        self.reconciled_results = self.known_secrets.union(self.possible_secrets)
-        self.possible_secrets = self.possible_secrets.difference_update(
-            self.known_secrets
+        known = WhitelistIndex(self.known_secrets)
+        self.reconciled_results = set(known)
+        self.reconciled_results.update(
+            secret for secret in self.possible_secrets if secret not in known
         )
-        if self.possible_secrets == None:
-            self.possible_secrets = set()
+        self.possible_secrets = set()
 
     @staticmethod
-    def write_whitelist_to_disk(scan_results):
+    def write_whitelist_to_disk(scan_results, path="whitelist.json"):
+        """
+        Writes the whitelist through a temporary file renamed over `path`, so a
+        crash never leaves it half written. Entries are ordered by classification
+        then secretGuid, and nothing is written when no entry has changed.
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
         try:
-            with open("whitelist.json", "w+") as whitelist:
-                results = jsons.dump(
-                    sorted(
-                        scan_results,
-                        key=lambda whitelist: whitelist.classification,
-                        reverse=True,
-                    )
-                )
+            results = jsons.dump(
+                sorted(
+                    sorted(scan_results, key=lambda whitelist: whitelist.secretGuid),
+                    key=lambda whitelist: whitelist.classification,
+                    reverse=True,
+                ),
+                strip_attr="refs",
+            )
+            previous = ScanResults._read_json(path)
+            if previous is not None and not ScanResults.whitelist_changes(previous, results):
+                return
+            with open(temporary, "w") as whitelist:
                 json.dump(results, whitelist, indent=4)
+                whitelist.flush()
+                os.fsync(whitelist.fileno())
+            os.replace(temporary, path)
         except Exception as e:
+            if os.path.exists(temporary):
+                os.remove(temporary)
             print(f"Unable to write to whitelist: {e}", file=sys.stderr)
 
     @staticmethod
-    def read_whitelist_from_disk():
+    def _read_json(path):
+        try:
+            with open(path, "r") as whitelist:
+                return json.load(whitelist)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def whitelist_changes(previous, results):
+        """
+        The secretGuids of the entries added, removed or modified between two
+        serialised whitelists.
+        """
+        previous = {entry.get("secretGuid"): entry for entry in previous}
+        current = {entry["secretGuid"]: entry for entry in results}
+        return {
+            guid
+            for guid in previous.keys() | current.keys()
+            if previous.get(guid) != current.get(guid)
+        }
+
+    @staticmethod
+    def read_whitelist_from_disk(acknowledged_only=False, path="whitelist.json"):
         try:
-            with open("whitelist.json", "r") as whitelist:
+            with open(path, "r") as whitelist:
                 file_contents = json.load(whitelist)
                 known_secrets = set()
                 for entry in file_contents:
+                    if acknowledged_only and entry.get("classification") not in Classifications.valid:
+                        continue
                     known_secrets.add(WhitelistEntry(**entry))
                 return known_secrets
         except FileNotFoundError as e:
@@ -68,6 +152,46 @@ class ScanResults:
             return set()
 
 
+class Finding:
+    """
+    A compact record of one detector hit: where it was found, the rule and the
+    string. Commit metadata is only looked up for the findings that survive
+    deduplication, when they are turned into WhitelistEntries.
+    """
+
+    __slots__ = ("commitHash", "path", "reason", "stringDetected")
+
+    def __init__(self, commitHash, path, reason, stringDetected):
+        self.commitHash = commitHash
+        self.path = path
+        self.reason = reason
+        self.stringDetected = stringDetected
+
+    def to_whitelist_entry(self, commit, commitAuthor, date):
+        return WhitelistEntry(
+            commit=commit,
+            commitAuthor=commitAuthor,
+            commitHash=self.commitHash,
+            date=date,
+            path=self.path,
+            reason=self.reason,
+            stringDetected=self.stringDetected,
+        )
+
+    def _identity(self):
+        # The same concatenation the secretGuid is hashed from.
+        return self.commitHash + str(self.path) + self.stringDetected
+
+    def __repr__(self):
+        return f"Finding in {self.commitHash}:{self.path}, String Detected:{self.stringDetected}"
+
+    def __eq__(self, other):
+        return self._identity() == other._identity()
+
+    def __hash__(self):
+        return hash(self._identity())
+
+
 class WhitelistEntry:
     def __init__(
         self,
@@ -82,6 +206,7 @@ class WhitelistEntry:
         secretGuid=None,
         confidence="High",
         classification="UNCLASSIFIED",
+        refs=None,
     ):
         self.commit = commit
         self.commitAuthor = commitAuthor
@@ -105,6 +230,7 @@ class WhitelistEntry:
             self.confidence = "Low"
 
         self.classification = WhitelistEntry.classify(classification)
+        self.refs = refs
 
     @staticmethod
     def classify(string):
@@ -128,6 +254,45 @@ class WhitelistEntry:
         return int(self.secretGuid, 16)
 
 
+def _timestamp(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S") + moment.strftime(".%f")[:4] + "Z"
+
+
+def commit_record(repo, commit):
+    """
+    The detection time and the commit details reported for a single commit scan.
+    """
+    now = datetime.datetime.utcnow()
+    commit = repo.commit(commit)
+    commit_timestamp = datetime.datetime.utcfromtimestamp(commit.authored_date)
+    return {
+        "detectionTimestamp": _timestamp(now),
+        "repository": commit.repo.git_dir,
+        "commit": commit.hexsha,
+        "commitMessage": commit.message.strip("\n"),
+        "commitTimestamp": _timestamp(commit_timestamp),
+    }
+
+
+def range_record(repo, walk):
+    """
+    The detection time and the revision walk reported for a range scan.
+    """
+    return {
+        "detectionTimestamp": _timestamp(datetime.datetime.utcnow()),
+        "repository": repo.git_dir,
+        "range": str(walk),
+    }
+
+
+def _counts_line(counts):
+    return " ".join(
+        "".join(f"{'  '+key:<35}{val:>7}\n" for key, val in counts)
+        .replace("\n", ",")
+        .split()
+    )
+
+
 class WhitelistStatistics:
     def __init__(self, whitelist_object, pipeline_mode):
         self.whitelist_object = {
@@ -159,6 +324,13 @@ class WhitelistStatistics:
     def count(self, attr):
         return len([getattr(entry, attr) for entry in self.whitelist_object])
 
+    def top_refs(self):
+        top_refs = ""
+        counter = Counter([ref for entry in self.whitelist_object for ref in entry.refs or ()])
+        for key, val in counter.most_common(10):
+            top_refs += f"{'  '+key:<35}{val:>7}\n"
+        return top_refs
+
     def breakdown(self):
         reason_breakdown = ""
         for given_reason in self.unique("reason"):
@@ -175,22 +347,26 @@ class WhitelistStatistics:
         }
 
     def to_dict_per_commit(self, repo, commit):
-        now = datetime.datetime.utcnow()
-        commit = repo.commit(commit)
-        commit_timestamp = datetime.datetime.utcfromtimestamp(commit.authored_date)
         return {
-            "detectionTimestamp": now.strftime("%Y-%m-%dT%H:%M:%S")
-            + now.strftime(".%f")[:4]
-            + "Z",
-            "repository": commit.repo.git_dir,
-            "commit": commit.hexsha,
-            "commitMessage": commit.message.strip("\n"),
-            "commitTimestamp": commit_timestamp.strftime("%Y-%m-%dT%H:%M:%S")
-            + commit_timestamp.strftime(".%f")[:4]
-            + "Z",
+            **commit_record(repo, commit),
             "totalStrings": self.count("stringDetected"),
             "uniqueStrings": len(self.unique("stringDetected")),
-            "findings": jsons.dump(self.whitelist_object),
+            "findings": jsons.dump(
+                self.whitelist_object,
+                strip_attr=() if self.top_refs() else "refs",
+            ),
+        }
+
+    def to_dict_per_range(self, repo, walk):
+        return {
+            **range_record(repo, walk),
+            "commitsWithFindings": len(self.unique("commitHash")),
+            "totalStrings": self.count("stringDetected"),
+            "uniqueStrings": len(self.unique("stringDetected")),
+            "findings": jsons.dump(
+                self.whitelist_object,
+                strip_attr=() if self.top_refs() else "refs",
+            ),
         }
 
     def __repr__(self):
@@ -206,19 +382,76 @@ class WhitelistStatistics:
             f"\nMost Common Secrets:\n"
             f"{self.top_secrets()}\n"
         )
+        if self.top_refs():
+            message += f"\nTop Refs:\n{self.top_refs()}\n"
         return message
 
 
+class StreamingStatistics:
+    """
+    The pipeline summary of a stream of findings, counted as they go past so
+    the findings themselves need not be kept.
+
+    Memory is not constant: the unique strings and the files with findings are
+    counted exactly, so they are kept, once each. It grows with the distinct
+    secrets and paths found rather than with every finding. The findings of a
+    commit arrive together, so commits are counted without being kept.
+    """
+
+    def __init__(self):
+        self.paths = Counter()
+        self.reasons = Counter()
+        self.strings = set()
+        self.commits = 0
+        self.last_commit = None
+        self.total = 0
+
+    def add(self, entry):
+        if entry.is_acknowledged():
+            return
+        self.paths[entry.path] += 1
+        self.reasons[entry.reason] += 1
+        self.strings.add(entry.stringDetected)
+        if entry.commitHash != self.last_commit:
+            self.commits += 1
+            self.last_commit = entry.commitHash
+        self.total += 1
+
+    def to_dict(self):
+        return {
+            "Files": len(self.paths),
+            "Total Strings": self.total,
+            "Unique Strings": len(self.strings),
+            "Categories": _counts_line(self.reasons.items()),
+            "Top Files": _counts_line(self.paths.most_common(10)),
+        }
+
+    def to_dict_per_commit(self, repo, commit):
+        return {
+            **commit_record(repo, commit),
+            "totalStrings": self.total,
+            "uniqueStrings": len(self.strings),
+        }
+
+    def to_dict_per_range(self, repo, walk):
+        return {
+            **range_record(repo, walk),
+            "commitsWithFindings": self.commits,
+            "totalStrings": self.total,
+            "uniqueStrings": len(self.strings),
+        }
+
+
 class Remediation:
     @staticmethod
-    def remediate_secrets():
+    def remediate_secrets(store=None):
         print(colored(f"Valid Classifications: (U)nclassified, (R)emediated, (F)alse Positive.", "green"))
         print(colored(f"(F)alse Positives: the category for items that are definitely not secrets.", "green"))
         print(colored(f"(R)emediated: the category for items are actually secrets and have been actioned appropriately.", "green"))
         print(colored(f"(U)ncategoried: the category for any outstanding item awaiting classification or action.", "green"))
         input("Press Any Key > ")
-        scan = ScanResults()
-        in_memory_whitelist = scan.read_whitelist_from_disk()
+        scan = ScanResults(store=store)
+        in_memory_whitelist = WhitelistIndex(scan.read_whitelist())
 
         if in_memory_whitelist:
             counter = Counter(
@@ -234,7 +467,7 @@ class Remediation:
                     break
                 Remediation.update_secret(secret[0], classification, in_memory_whitelist)
 
-            ScanResults.write_whitelist_to_disk(in_memory_whitelist)
+            scan.write_whitelist(in_memory_whitelist)
 
     @staticmethod
     def user_classify_secrets(secret, commitHash):
@@ -259,46 +492,104 @@ class Remediation:
 
     @staticmethod
     def update_secret(secret, classification, whitelist):
-        for entry in whitelist:
-            if entry.stringDetected == secret:
-                entry.classification = classification
+        for entry in whitelist.with_string(secret):
+            entry.classification = classification
 
 class MetricCalculation:
+    WHITELIST_PATH = "whitelist.json"
+    NULL_HEX_SHA = "0" * 40
+
+    @staticmethod
+    def whitelist_blob(commitSha, repo):
+        try:
+            return (repo.commit(commitSha).tree / MetricCalculation.WHITELIST_PATH).hexsha
+        except KeyError:
+            return None
+
+    @staticmethod
+    def parse_whitelist_blob(blobSha, repo):
+        """
+        The whitelist stored in a blob, indexed by secretGuid.
+        """
+        if not blobSha or blobSha == MetricCalculation.NULL_HEX_SHA:
+            return WhitelistIndex()
+        whitelist_object = json.loads(repo.odb.stream(bytes.fromhex(blobSha)).read())
+        return WhitelistIndex(WhitelistEntry(**entry) for entry in whitelist_object)
+
+    @staticmethod
+    def divergent_entries(current_whitelist, previous_whitelist):
+        return {
+            entry
+            for entry in current_whitelist
+            if entry in previous_whitelist
+            and previous_whitelist.get(entry.secretGuid).classification != entry.classification
+        }
+
     @staticmethod
     def find_divergent_results(commitSha, repo):
-        divergent_results = set()
         current = repo.commit(commitSha)
         previous = current.parents[0]
 
         current_whitelist = MetricCalculation.load_in_memory_whitelist(current.hexsha, repo)
         previous_whitelist = MetricCalculation.load_in_memory_whitelist(previous.hexsha, repo)
-
-        for i in current_whitelist:
-            for j in previous_whitelist:
-                if i == j and i.classification != j.classification:
-                    divergent_results.add(i)
-        return divergent_results
+        return MetricCalculation.divergent_entries(current_whitelist, previous_whitelist)
 
     @staticmethod
     def load_in_memory_whitelist(commitSha, repo):
-        entries = set()
-        whitelist_repr = ""
-        for commit,lines in repo.blame(commitSha, "whitelist.json"):
-            for entry in lines:
-                whitelist_repr += entry
+        return MetricCalculation.parse_whitelist_blob(
+            MetricCalculation.whitelist_blob(commitSha, repo), repo
+        )
 
-        whitelist_object = json.loads(whitelist_repr)
-        for entry in whitelist_object:
-            entries.add(WhitelistEntry(**entry))
-        return entries
+    @staticmethod
+    def whitelist_revisions(rev, repo):
+        """
+        Yields (commit, previous blob, blob) for every commit in `rev` that
+        changed the whitelist, oldest first, from a single `git log`. Merges are
+        compared with their first parent, as find_divergent_results does.
+        """
+        log = repo.git.log(
+            "--format=%x00%H",
+            "--raw",
+            "--no-abbrev",
+            "--diff-merges=first-parent",
+            "--reverse",
+            rev,
+            "--",
+            MetricCalculation.WHITELIST_PATH,
+        )
+        commitSha = None
+        for line in log.splitlines():
+            if line.startswith("\x00"):
+                commitSha = line[1:]
+            elif line.startswith(":"):
+                _, _, previous_blob, blob, _ = line.split("\t")[0].split()
+                yield commitSha, previous_blob, blob
 
     @staticmethod
-    def validate(commitSha, repo, whitelist_entry):
-        commit = repo.commit(whitelist_entry.commitHash)
+    def find_acknowledgements(rev, repo):
+        """
+        Yields (commit, divergent entries) for every revision of the whitelist in
+        `rev`, in one pass over its history.
+        """
+        # Each revision is the previous one of the next, so it is parsed once.
+        parse = lru_cache(maxsize=16)(lambda blobSha: MetricCalculation.parse_whitelist_blob(blobSha, repo))
+        for commitSha, previous_blob, blob in MetricCalculation.whitelist_revisions(rev, repo):
+            previous_whitelist = parse(previous_blob)
+            current_whitelist = parse(blob)
+            divergent = MetricCalculation.divergent_entries(current_whitelist, previous_whitelist)
+            if divergent:
+                yield commitSha, divergent
+
+    @staticmethod
+    def committer(commit):
         committed_date = datetime.datetime.utcfromtimestamp(commit.committed_date)
         committed_date = committed_date.strftime("%Y-%m-%dT%H:%M:%S") + committed_date.strftime(".%f")[:4] + "Z"
         return commit.committer.email, committed_date
 
+    @staticmethod
+    def validate(commitSha, repo, whitelist_entry):
+        return MetricCalculation.committer(repo.commit(whitelist_entry.commitHash))
+
     @staticmethod
     def secret_acknowledgement(whitelist_entry, committer, commited_date):
         return {
@@ -315,4 +606,20 @@ class MetricCalculation:
             with open(f"{result.secretGuid}.json", 'w+') as file:
                 json.dump(MetricCalculation.secret_acknowledgement(result, committer, committed_date), file)
 
+    @staticmethod
+    def dump_json_range(rev, repo):
+        # A secret can be acknowledged by several revisions, so each one gets
+        # its own record, credited to the revision's committer.
+        for commitSha, results in MetricCalculation.find_acknowledgements(rev, repo):
+            committer, committed_date = MetricCalculation.committer(repo.commit(commitSha))
+            for result in results:
+                with open(f"{commitSha}-{result.secretGuid}.json", 'w+') as file:
+                    json.dump(
+                        {
+                            **MetricCalculation.secret_acknowledgement(result, committer, committed_date),
+                            "ackCommit": commitSha,
+                        },
+                        file,
+                    )
+
 